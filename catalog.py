@@ -0,0 +1,229 @@
+"""
+Catalog of source videos and frames extracted from them (SQLite)
+
+videos - path, size, mtime, duration, fps, frames count, codec, resolution
+images - saved image -> video, frame number, timestamp
+
+Usage:
+python catalog.py scan "/path/to/videos/" --ext ".mp4"
+python catalog.py import "/path/to/videos/dataset"
+python catalog.py find --video "cam1" --start "0:10:00" --end "0:20:00"
+python catalog.py source "/path/to/videos/dataset/cam1_125.jpg"
+
+Scan is incremental: only new videos or videos with changed size/mtime are probed, in a process pool.
+"""
+
+from functions import Manifest, get_filelist
+
+import os
+import sqlite3
+import argparse
+import cv2
+from concurrent.futures import ProcessPoolExecutor
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Videos and extracted frames catalog")
+    parser.add_argument(
+        "--db",
+        type=str,
+        default="catalog.sqlite",
+        help="Catalog database path",
+    )
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan = subparsers.add_parser("scan", help="Add/update videos in the folder (recursively)")
+    scan.add_argument("videos", type=str, help="Folder with videos")
+    scan.add_argument("-e", "--ext", type=str, default=".mp4", help="Videos extension")
+    scan.add_argument("-w", "--workers", type=int, default=None, help="Number of processes")
+
+    imp = subparsers.add_parser("import", help="Add saved frames from the dataset folder manifest")
+    imp.add_argument("dataset", type=str, help="Dataset folder with manifest.sqlite")
+
+    find = subparsers.add_parser("find", help="Find saved frames by video and time")
+    find.add_argument("--video", type=str, default="", help="Part of the video path")
+    find.add_argument("--start", type=str, default="0", help="From time, \"hh:mm:ss\" or seconds")
+    find.add_argument("--end", type=str, default="", help="To time, \"hh:mm:ss\" or seconds")
+
+    source = subparsers.add_parser("source", help="Show the source frame of the image")
+    source.add_argument("image", type=str, help="Saved image path")
+
+    args = parser.parse_args()
+    return args
+
+
+def parse_time(value):
+    """"hh:mm:ss", "mm:ss" or seconds -> msec"""
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds * 1000
+
+
+def probe(video):
+    """video metadata from the container"""
+    st = os.stat(video)
+    cap = cv2.VideoCapture(video)
+    try:
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        return {"path": os.path.abspath(video),
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+                "fps": fps,
+                "frames": frames,
+                "duration": frames / fps if fps else None,
+                "codec": "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip("\x00"),
+                "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}
+    finally:
+        cap.release()
+
+
+class Catalog:
+    """
+    Usage:
+    catalog = Catalog("catalog.sqlite")
+    catalog.scan(videos_list)
+    info = catalog.video(video)  # cached metadata, probes only unknown or changed videos
+    catalog.import_manifest(dataset_folder)
+    for image, video, frame_id, msec in catalog.find("cam1", 600000, 1200000):
+        ...
+    """
+
+    COLUMNS = ("path", "size", "mtime", "fps", "frames", "duration", "codec", "width", "height")
+
+    def __init__(self, path="catalog.sqlite"):
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS videos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT UNIQUE NOT NULL,
+                size INTEGER,
+                mtime INTEGER,
+                fps REAL,
+                frames INTEGER,
+                duration REAL,
+                codec TEXT,
+                width INTEGER,
+                height INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                video_id INTEGER NOT NULL REFERENCES videos (id),
+                frame INTEGER NOT NULL,
+                msec REAL,
+                saved_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS images_video ON images (video_id, msec);
+        """)
+
+    def close(self):
+        self.db.close()
+
+    def scan(self, videos, workers=None):
+        """probe new and changed videos in a process pool, returns number of probed videos"""
+        changed = [video for video in videos if self._changed(video)]
+        if not changed:
+            return 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            infos = list(pool.map(probe, changed, chunksize=8))
+        with self.db:
+            for info in infos:
+                self._upsert(info)
+        return len(changed)
+
+    def video(self, video):
+        """metadata dict of the video, probed only if it is not in the catalog or changed"""
+        if self._changed(video):
+            with self.db:
+                self._upsert(probe(video))
+        row = self.db.execute("SELECT {} FROM videos WHERE path = ?".format(", ".join(self.COLUMNS)),
+                              (os.path.abspath(video),)).fetchone()
+        return dict(zip(self.COLUMNS, row))
+
+    def import_manifest(self, folder):
+        """add frames saved to the dataset folder, drop deleted ones. returns number of frames"""
+        manifest = Manifest(folder)
+        rows = manifest.db.execute("SELECT name, video, frame, msec, saved_at, deleted FROM frames").fetchall()
+        manifest.close()
+
+        video_ids = {}
+        for video in {row[1] for row in rows if "://" not in row[1]}:
+            if os.path.isfile(video):
+                self.video(video)
+            found = self.db.execute("SELECT id FROM videos WHERE path = ?", (video,)).fetchone()
+            if found:
+                video_ids[video] = found[0]
+
+        added = 0
+        with self.db:
+            for name, video, frame_id, msec, saved_at, deleted in rows:
+                path = os.path.abspath(os.path.join(folder, name))
+                if deleted or video not in video_ids:
+                    self.db.execute("DELETE FROM images WHERE path = ?", (path,))
+                    continue
+                self.db.execute("INSERT OR REPLACE INTO images (path, video_id, frame, msec, saved_at) "
+                                "VALUES (?, ?, ?, ?, ?)", (path, video_ids[video], frame_id, msec, saved_at))
+                added += 1
+        return added
+
+    def find(self, video="", start=0.0, end=None):
+        """[(image, video, frame, msec)] of videos whose path contains video, between start and end msec"""
+        query = ("SELECT images.path, videos.path, images.frame, images.msec FROM images "
+                 "JOIN videos ON videos.id = images.video_id WHERE videos.path LIKE ? AND images.msec >= ?")
+        params = ["%{}%".format(video), start]
+        if end is not None:
+            query += " AND images.msec <= ?"
+            params.append(end)
+        return self.db.execute(query + " ORDER BY videos.path, images.msec", params).fetchall()
+
+    def source(self, image):
+        """(video, frame, msec) of the saved image or None"""
+        return self.db.execute("SELECT videos.path, images.frame, images.msec FROM images "
+                               "JOIN videos ON videos.id = images.video_id WHERE images.path = ?",
+                               (os.path.abspath(image),)).fetchone()
+
+    def _changed(self, video):
+        st = os.stat(video)
+        row = self.db.execute("SELECT size, mtime FROM videos WHERE path = ?", (os.path.abspath(video),)).fetchone()
+        return row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns
+
+    def _upsert(self, info):
+        self.db.execute("INSERT INTO videos ({0}) VALUES ({1}) ON CONFLICT (path) DO UPDATE SET {2}".format(
+            ", ".join(self.COLUMNS), ", ".join("?" * len(self.COLUMNS)),
+            ", ".join("{0} = excluded.{0}".format(c) for c in self.COLUMNS[1:])),
+            [info[c] for c in self.COLUMNS])
+
+
+def main(opt):
+    catalog = Catalog(opt.db)
+
+    if opt.command == "scan":
+        videos = get_filelist(opt.videos, opt.ext)
+        probed = catalog.scan(videos, opt.workers)
+        print("videos: {}, probed: {}, unchanged: {}".format(len(videos), probed, len(videos) - probed))
+
+    elif opt.command == "import":
+        print("frames imported: {}".format(catalog.import_manifest(opt.dataset)))
+
+    elif opt.command == "find":
+        rows = catalog.find(opt.video, parse_time(opt.start), parse_time(opt.end) if opt.end else None)
+        for image, video, frame_id, msec in rows:
+            print("{}  {}  frame {}  {:.3f}s".format(image, video, frame_id, msec / 1000))
+        print("found: {}".format(len(rows)))
+
+    elif opt.command == "source":
+        found = catalog.source(opt.image)
+        if found is None:
+            print("{} is not in the catalog".format(opt.image))
+        else:
+            print("{}  frame {}  {:.3f}s".format(*found[:2], found[2] / 1000))
+
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main(get_args())
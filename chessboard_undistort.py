@@ -1,58 +1,450 @@
+from functions import Reader
+
+import os
+import time
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import cv2
 import glob
 
-CHECKERBOARD = (6, 9)
+"""
+Camera calibration by chessboard images
+
+Corners are found in a process pool and cached in corners.npz next to the images
+(an image is processed again only if its size/mtime changed), then the camera is calibrated once
+on all found boards. Camera matrix and distortion coefficients are saved to calibration.npz.
+
+For high resolution images use --detect-width: the board is found on a downscaled copy
+(images without a board are rejected there quickly) and corners are refined at full resolution.
+
+Usage:
+python chessboard_undistort.py --images "./chessboard_exmpl/dataset" --board 6 9
+python chessboard_undistort.py --images "./chessboard_exmpl/dataset" --preview
+python chessboard_undistort.py --images "/path/to/5mp_images" --detect-width 800
+python chessboard_undistort.py --images "./chessboard_exmpl/dataset" --benchmark --detect-width 360
+python chessboard_undistort.py --video "/path/to/calibration.mp4" --frames 30
+
+Video mode checks downscaled frames for the board in a process pool in one pass, then greedily picks
+frames that differ the most by board position, size and tilt, so the selection covers the whole image.
+Only the picked frames are refined at full resolution, saved to <video name>_calibration folder and used for calibration.
+"""
 
 # termination criteria
 criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
 
-# prepare object points, like (0,0,0), (1,0,0), (2,0,0) ....,(6,5,0)
-objp = np.zeros((1, CHECKERBOARD[0] * CHECKERBOARD[1], 3), np.float32)
-objp[0, :, :2] = np.mgrid[0:CHECKERBOARD[0], 0:CHECKERBOARD[1]].T.reshape(-1, 2)
-prev_img_shape = None
 
-# Arrays to store object points and image points from all the images.
-objpoints = []  # 3d point in real world space
-imgpoints = []  # 2d points in image plane.
-images = glob.glob('./chessboard_exmpl/dataset/*.jpg')
+def get_args():
+    parser = argparse.ArgumentParser("Camera calibration by chessboard images")
+    parser.add_argument(
+        "-i",
+        "--images",
+        type=str,
+        default="./chessboard_exmpl/dataset",
+        help="Folder with chessboard images",
+    )
+
+    parser.add_argument(
+        "-e",
+        "--ext",
+        type=str,
+        default=".jpg",
+        help="Images extension",
+    )
+
+    parser.add_argument(
+        "-b",
+        "--board",
+        type=int,
+        nargs=2,
+        default=(6, 9),
+        help="Number of inner corners of the chessboard",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes (default - all cores)",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="",
+        help="Calibration file, default - calibration.npz in the images dir",
+    )
+
+    parser.add_argument(
+        "-v",
+        "--video",
+        type=str,
+        default="",
+        help="Calibration video: frames with the board are selected automatically",
+    )
+
+    parser.add_argument(
+        "--step",
+        type=int,
+        default=1,
+        help="Video mode: check every n-th frame",
+    )
+
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=30,
+        help="Video mode: number of frames to calibrate on",
+    )
+
+    parser.add_argument(
+        "--detect-width",
+        type=int,
+        default=0,
+        help="Find the board on images downscaled to this width, refine corners at full resolution. "
+             "0 - full resolution (640 in video mode)",
+    )
 
-for fname in images:
-    img = cv2.imread(fname)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    # Find the chess board corners
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Compare speed and accuracy of --detect-width with the full resolution detection and exit",
+    )
+
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help="Show found corners and undistorted images, any key - next, Q - quit",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def object_points(board):
+    """(0,0,0), (1,0,0), (2,0,0) ....,(6,5,0)"""
+    objp = np.zeros((board[0] * board[1], 3), np.float32)
+    objp[:, :2] = np.mgrid[0:board[0], 0:board[1]].T.reshape(-1, 2)
+    return objp
+
+
+def downscale(gray, detect_width=0):
+    """(image downscaled to detect_width, scale)"""
+    h, w = gray.shape
+    if not detect_width or w <= detect_width:
+        return gray, 1
+    scale = w / detect_width
+    return cv2.resize(gray, (detect_width, round(h / scale)), interpolation=cv2.INTER_AREA), scale
+
+
+def check_board(small, board):
+    """corners found on the (downscaled) image or None"""
     # If desired number of corners are found in the image then ret = true
-    ret, corners = cv2.findChessboardCorners(gray, CHECKERBOARD,
+    # FAST_CHECK быстро отбрасывает кадры без доски
+    ret, corners = cv2.findChessboardCorners(small, board,
                                              cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_FAST_CHECK + cv2.CALIB_CB_NORMALIZE_IMAGE)
+    return corners.reshape(-1, 1, 2) if ret else None
+
+
+def refine(gray, corners, scale=1):
+    """corners of the image downscaled by scale -> refined corners of the full resolution gray image"""
+    # Углы с уменьшенной копии переводятся в полное разрешение, окно уточнения покрывает ошибку масштаба
+    win = 11
+    if scale > 1:
+        corners = (corners + 0.5) * scale - 0.5
+        win = max(win, int(round(scale * 3)))
+    # refining pixel coordinates for given 2d points.
+    corners = cv2.cornerSubPix(gray, corners.astype(np.float32), (win, win), (-1, -1), criteria)
+    return corners.reshape(-1, 1, 2)
+
+
+def find_corners(fname, board, detect_width=0):
+    """
+    (image size (w, h), refined corners or None)
+    detect_width - find the board on the image downscaled to this width
+    """
+    gray = cv2.imread(fname, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None, None
+    small, scale = downscale(gray, detect_width)
+    corners = check_board(small, board)
+    if corners is None:
+        return gray.shape[::-1], None
+    return gray.shape[::-1], refine(gray, corners, scale)
+
+
+class CornersCache:
+    """
+    corners.npz: for every image - size, mtime, image size and found corners (NaN if not found).
+    The cache is reset if the board or detect_width changes
 
-    if ret:
-        objpoints.append(objp)
-        # refining pixel coordinates for given 2d points.
-        corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+    Usage:
+    cache = CornersCache(folder, board, detect_width)
+    todo = cache.missing(images)
+    cache.put(fname, image_size, corners)
+    cache.save(images)
+    """
 
-        imgpoints.append(corners2)
+    def __init__(self, folder, board, detect_width=0):
+        self.path = os.path.join(folder, "corners.npz")
+        self.board = tuple(board)
+        self.detect_width = detect_width
+        self.items = {}
+        if os.path.isfile(self.path):
+            data = np.load(self.path)
+            if tuple(data["board"]) == self.board and int(data.get("detect_width", 0)) == detect_width:
+                for name, stat, size, corners in zip(data["names"], data["stats"], data["sizes"], data["corners"]):
+                    self.items[str(name)] = (tuple(stat), tuple(size), None if np.isnan(corners).any() else corners)
 
-        # Draw and display the corners
-        img = cv2.drawChessboardCorners(img, CHECKERBOARD, corners2, ret)
+    @staticmethod
+    def _stat(fname):
+        st = os.stat(fname)
+        return st.st_size, st.st_mtime_ns
 
-        h, w = img.shape[:2]
+    def missing(self, images):
+        return [fname for fname in images
+                if os.path.basename(fname) not in self.items
+                or self.items[os.path.basename(fname)][0] != self._stat(fname)]
 
-        ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
-        newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (w, h), 1, (w, h))
-        dst = cv2.undistort(img, mtx, dist, None, newcameramtx)
+    def get(self, fname):
+        """(image size, corners or None)"""
+        return self.items[os.path.basename(fname)][1:]
 
+    def put(self, fname, image_size, corners):
+        self.items[os.path.basename(fname)] = (self._stat(fname), tuple(image_size), corners)
 
-    else:
-        print(f"Did not recog on img {fname.split('/')[-1]}")
+    def save(self, images):
+        """keep only existing images"""
+        names = [os.path.basename(fname) for fname in images if os.path.basename(fname) in self.items]
+        empty = np.full((self.board[0] * self.board[1], 1, 2), np.nan, np.float32)
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, board=np.array(self.board), detect_width=np.array(self.detect_width),
+                 names=np.array(names, dtype=str),
+                 stats=np.array([self.items[n][0] for n in names], np.int64).reshape(-1, 2),
+                 sizes=np.array([self.items[n][1] for n in names], np.int64).reshape(-1, 2),
+                 corners=np.array([empty if self.items[n][2] is None else self.items[n][2] for n in names],
+                                  np.float32).reshape(-1, *empty.shape))
+        os.replace(tmp, self.path)
+
+
+def detect(images, board, workers=None, detect_width=0):
+    """{fname: (image size, corners or None)}, only new and changed images are processed"""
+    folder = os.path.dirname(images[0])
+    cache = CornersCache(folder, board, detect_width)
+    todo = cache.missing(images)
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for fname, (size, corners) in zip(todo, pool.map(find_corners, todo, [board] * len(todo),
+                                                             [detect_width] * len(todo), chunksize=4)):
+                if size is not None:
+                    cache.put(fname, size, corners)
+        cache.save(images)
+    print("images: {}, cached: {}".format(len(images), len(images) - len(todo)))
+    return {fname: cache.get(fname) for fname in images if os.path.basename(fname) in cache.items}
+
+
+def calibrate(detections, board):
+    """one calibrateCamera on all found boards, returns dict to save"""
+    sizes = Counter(size for size, corners in detections.values() if corners is not None)
+    if not sizes:
+        raise RuntimeError("chessboard was not found on any image")
+    image_size = sizes.most_common(1)[0][0]
+    imgpoints = [corners for size, corners in detections.values() if corners is not None and size == image_size]
+    objpoints = [object_points(board)] * len(imgpoints)
+
+    rms, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, image_size, None, None)
+    newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, image_size, 1, image_size)
+    print("calibrated on {} images {}x{}, reprojection error {:.3f}px".format(len(imgpoints), *image_size, rms))
+    return {"mtx": mtx, "dist": dist, "size": np.array(image_size), "new_mtx": newcameramtx,
+            "roi": np.array(roi), "rms": rms}
+
+
+def benchmark(images, board, detect_width):
+    """full resolution vs downscaled detection: time, found boards, corners difference, calibration error"""
+    results = {}
+    for width in (0, detect_width):
+        start = time.perf_counter()
+        detections = {fname: find_corners(fname, board, width) for fname in images}
+        seconds = time.perf_counter() - start
+        found = sum(corners is not None for size, corners in detections.values())
+        print("{}: {:.3f}s ({:.1f} ms/image), found {}/{}".format(
+            "detect width {}".format(width) if width else "full resolution", seconds,
+            1000 * seconds / len(images), found, len(images)))
+        results[width] = detections
+
+    diffs = [np.linalg.norm(results[0][fname][1] - results[detect_width][fname][1], axis=-1)
+             for fname in images if results[0][fname][1] is not None and results[detect_width][fname][1] is not None]
+    if diffs:
+        diffs = np.concatenate(diffs)
+        print("corners difference: mean {:.3f}px, max {:.3f}px".format(diffs.mean(), diffs.max()))
+    for width, detections in results.items():
+        if any(corners is not None for size, corners in detections.values()):
+            calibrate(detections, board)
+
+
+def board_features(corners, board, size):
+    """[center x, center y, board size, horizontal tilt, vertical tilt] of the image"""
+    c = corners.reshape(board[1], board[0], 2)
+    quad = np.array([c[0, 0], c[0, -1], c[-1, -1], c[-1, 0]], np.float32)
+    top, right, bottom, left = np.linalg.norm(quad - np.roll(quad, -1, axis=0), axis=1)
+    x, y = quad.mean(axis=0) / size
+    area = cv2.contourArea(quad) / (size[0] * size[1])
+    return [x, y, np.sqrt(area), (top - bottom) / (top + bottom), (left - right) / (left + right)]
+
+
+def select_frames(features, count):
+    """
+    greedy farthest point selection: every next frame is the most different from already selected ones
+    returns indexes of selected rows
+    """
+    features = np.asarray(features, np.float64)
+    features = (features - features.mean(axis=0)) / (features.std(axis=0) + 1e-6)
+    # первым берётся самый нетипичный кадр
+    selected = [int(np.argmax(np.linalg.norm(features, axis=1)))]
+    distance = np.linalg.norm(features - features[selected[0]], axis=1)
+    while len(selected) < min(count, len(features)):
+        i = int(np.argmax(distance))
+        if distance[i] == 0:
+            break
+        selected.append(i)
+        distance = np.minimum(distance, np.linalg.norm(features - features[i], axis=1))
+    return selected
+
+
+def scan_video(video, board, detect_width=640, step=1, workers=None):
+    """
+    one pass over the video, downscaled frames are checked in a process pool
+    returns (frame size, scale, {frame id: corners of the downscaled frame})
+    """
+    cap = cv2.VideoCapture(video)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    size, scale = None, 1
+    found = {}
+    pending = deque()
+    frame_id = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Ограничиваем число кадров в очереди пула
+        limit = 4 * (workers or os.cpu_count() or 1)
+        try:
+            while cap.grab():
+                if frame_id % step == 0:
+                    ret, frame = cap.retrieve()
+                    if ret:
+                        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                        size = gray.shape[::-1]
+                        small, scale = downscale(gray, detect_width)
+                        pending.append((frame_id, pool.submit(check_board, small, board)))
+                while pending and (len(pending) > limit or pending[0][1].done()):
+                    i, job = pending.popleft()
+                    corners = job.result()
+                    if corners is not None:
+                        found[i] = corners
+                frame_id += 1
+                if frame_id % 500 == 0:
+                    print("\rframes {}/{}, with board {}".format(frame_id, total, len(found)), end="")
+        finally:
+            cap.release()
+        for i, job in pending:
+            corners = job.result()
+            if corners is not None:
+                found[i] = corners
+    print("\rframes {}, checked {}, with board {}".format(frame_id, (frame_id + step - 1) // step, len(found)))
+    return size, scale, found
+
+
+def calibrate_video(video, board, count=30, detect_width=640, step=1, workers=None):
+    """returns (calibration, {saved frame path: (frame size, corners)})"""
+    size, scale, found = scan_video(video, board, detect_width, step, workers)
+    if not found:
+        raise RuntimeError("chessboard was not found in {}".format(video))
+
+    frame_ids = sorted(found)
+    small_size = (round(size[0] / scale), round(size[1] / scale))
+    features = [board_features(found[i], board, small_size) for i in frame_ids]
+    selected = sorted(frame_ids[i] for i in select_frames(features, count))
+
+    # Доля ячеек сетки 10x10, покрытых углами выбранных кадров
+    cells = set()
+    for i in selected:
+        cells.update(map(tuple, (found[i].reshape(-1, 2) / small_size * 10).astype(int).tolist()))
+    print("selected {} frames, image area coverage {:.0%}".format(len(selected), len(cells) / 100))
+
+    folder = os.path.splitext(video)[0] + "_calibration"
+    os.makedirs(folder, exist_ok=True)
+    reader = Reader(cv2.VideoCapture(video), max_skip=100)
+    detections = {}
+    try:
+        for frame_id in selected:
+            frame = reader[frame_id]
+            if frame is None:
+                continue
+            fname = os.path.join(folder, "frame_{}.jpg".format(frame_id))
+            cv2.imwrite(fname, frame)
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            detections[fname] = (size, refine(gray, found[frame_id], scale))
+    finally:
+        reader.cap.release()
+    return calibrate(detections, board), detections
+
+
+def preview(detections, calibration, board):
+    mtx, dist, newcameramtx = calibration["mtx"], calibration["dist"], calibration["new_mtx"]
+    x, y, w, h = calibration["roi"]
     cv2.namedWindow("orig", cv2.WINDOW_NORMAL)
     cv2.namedWindow("dist", cv2.WINDOW_NORMAL)
-    cv2.imshow('orig', img)
-    if ret:
-        x, y, w, h = roi
-        dst = dst[y:y + h, x:x + w]
-        cv2.imshow('dist', dst)
+    for fname, (size, corners) in detections.items():
+        img = cv2.imread(fname)
+        if corners is not None:
+            # Draw and display the corners
+            img = cv2.drawChessboardCorners(img, board, corners, True)
+        cv2.imshow('orig', img)
+        if tuple(size) == tuple(calibration["size"]):
+            dst = cv2.undistort(img, mtx, dist, None, newcameramtx)
+            cv2.imshow('dist', dst[y:y + h, x:x + w])
+        if cv2.waitKey(0) & 0xFF == ord("q"):
+            break
+    cv2.destroyAllWindows()
+
+
+def main(opt):
+    board = tuple(opt.board)
+
+    if opt.video:
+        calibration, detections = calibrate_video(opt.video, board, opt.frames, opt.detect_width or 640, opt.step,
+                                                  opt.workers)
+        output = opt.output or os.path.join(os.path.splitext(opt.video)[0] + "_calibration", "calibration.npz")
+        np.savez(output, **calibration)
+        print("saved to", output)
+        if opt.preview:
+            preview(detections, calibration, board)
+        return
+
+    images = sorted(glob.glob(os.path.join(opt.images, "*" + opt.ext)))
+    if not images:
+        print("no images in", opt.images)
+        return
+
+    if opt.benchmark:
+        benchmark(images, board, opt.detect_width or 640)
+        return
+
+    detections = detect(images, board, opt.workers, opt.detect_width)
+    for fname, (size, corners) in detections.items():
+        if corners is None:
+            print(f"Did not recog on img {os.path.basename(fname)}")
+
+    calibration = calibrate(detections, board)
+    output = opt.output or os.path.join(opt.images, "calibration.npz")
+    np.savez(output, **calibration)
+    print("saved to", output)
 
-    cv2.waitKey(0)
+    if opt.preview:
+        preview(detections, calibration, board)
 
-cv2.destroyAllWindows()
 
+if __name__ == "__main__":
+    main(get_args())
@@ -1,25 +1,939 @@
 import os
 import string
 import random
+import time
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import cv2
+import numpy as np
+
+
+class FrameIndex:
+    """
+    Keyframe/timestamp index of a video, stored next to it as <video>.idx.npz
+
+    Built once by demuxing packets without decoding them (CAP_PROP_FORMAT=-1),
+    rebuilt when size or mtime of the video changes.
+    keyframe() and frame_at() return None until the index is ready.
+
+    Usage:
+    index = FrameIndex(video).open()  # load the sidecar or build it in background
+    reader = Reader(cv2.VideoCapture(video), index=index)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sidecar = path + ".idx.npz"
+        self.keyframes = None
+        self.pts = None
+        self.thread = None
+        self._ready = threading.Event()
+
+    def __len__(self):
+        return len(self.pts) if self.ready() else 0
+
+    def ready(self):
+        return self._ready.is_set()
+
+    def open(self, background=True):
+        if not self.load():
+            if background:
+                self.thread = threading.Thread(target=self.build, daemon=True)
+                self.thread.start()
+            else:
+                self.build()
+        return self
+
+    def load(self):
+        if not os.path.isfile(self.sidecar):
+            return False
+        try:
+            st = os.stat(self.path)
+            with np.load(self.sidecar) as data:
+                if int(data["size"]) != st.st_size or int(data["mtime"]) != st.st_mtime_ns:
+                    return False
+                self.keyframes = data["keyframes"]
+                self.pts = data["pts"]
+        except Exception as e:
+            print("- can`t load index {}: {}".format(self.sidecar, e))
+            return False
+        self._ready.set()
+        return True
+
+    def build(self):
+        st = os.stat(self.path)
+        cap = cv2.VideoCapture(self.path)
+        cap.set(cv2.CAP_PROP_FORMAT, -1)  # raw packets, no decoding
+        keyframes, pts = [], []
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) > 0:
+                keyframes.append(len(pts))
+            pts.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+        cap.release()
+
+        if not keyframes:
+            print("- no keyframes info for {}, index disabled".format(self.path))
+            return
+
+        self.keyframes = np.array(keyframes, dtype=np.int64)
+        # packets come in decoding order
+        self.pts = np.sort(np.array(pts, dtype=np.float64))
+        try:
+            tmp = self.sidecar + ".tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, keyframes=self.keyframes, pts=self.pts, size=st.st_size, mtime=st.st_mtime_ns)
+            os.replace(tmp, self.sidecar)
+        except OSError as e:
+            print("- can`t save index {}: {}".format(self.sidecar, e))
+        self._ready.set()
+
+    def msec(self, frame_id):
+        """timestamp of the frame"""
+        if not self.ready() or not 0 <= frame_id < len(self.pts):
+            return None
+        return float(self.pts[frame_id])
+
+    def keyframe(self, frame_id):
+        """nearest keyframe at or before frame_id"""
+        if not self.ready():
+            return None
+        i = int(np.searchsorted(self.keyframes, frame_id, side="right")) - 1
+        return int(self.keyframes[max(i, 0)])
+
+    def frame_at(self, msec):
+        """id of the frame shown at msec"""
+        if not self.ready():
+            return None
+        return max(0, int(np.searchsorted(self.pts, msec, side="right")) - 1)
 
 
 class Reader:
-    def __init__(self, cap):
+    """
+    Video reader with random access
+
+    With a ready FrameIndex jumps go to the nearest keyframe and decode forward,
+    otherwise they rely on CAP_PROP_POS_FRAMES seeking.
+
+    Usage:
+    reader = Reader(cv2.VideoCapture(video), index=FrameIndex(video).open())
+    frame = reader[1000]
+    frames = reader[1000:1100:10]
+    for frame in reader.iter(step=25):
+        ...
+    """
+
+    def __init__(self, cap, index=None, max_skip=30):
         self.cap = cap
+        self.index = index
+        self.max_skip = max_skip
+        self.decoder_pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        self.seeks = 0
 
-    def read(self):
+    def read(self, image=None):
+        """image - optional buffer of the frame size to decode into"""
         try:
-            _, fr = self.cap.read()
-            return fr
+            _, fr = self.cap.read(image)
         except:
             return None
+        if fr is not None:
+            self.decoder_pos += 1
+        return fr
 
     def get_information(self):
         return [self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT),
                 self.cap.get(cv2.CAP_PROP_FRAME_WIDTH),
                 self.cap.get(cv2.CAP_PROP_FPS)]
 
+    def __len__(self):
+        if self.index is not None and self.index.ready():
+            return len(self.index)
+        return int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return list(self.iter(*item.indices(len(self))))
+        if item < 0:
+            item += len(self)
+        return self._get(item)
+
+    def __iter__(self):
+        return self.iter()
+
+    def iter(self, start=0, stop=None, step=1):
+        stop = len(self) if stop is None else stop
+        for frame_id in range(start, stop, step):
+            frame = self._get(frame_id)
+            if frame is None:
+                return
+            yield frame
+
+    def goto(self, frame_id):
+        """move the decoder so the next read() returns frame_id"""
+        key = self.index.keyframe(frame_id) if self.index is not None else None
+        if key is not None:
+            # jump only if decoding forward would not pass through the keyframe anyway
+            jump = frame_id < self.decoder_pos or key > self.decoder_pos
+            target = key
+        else:
+            jump = not self.decoder_pos <= frame_id <= self.decoder_pos + self.max_skip
+            target = frame_id
+
+        if jump:
+            self.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=target)
+            self.decoder_pos = target
+            self.seeks += 1
+
+        while self.decoder_pos < frame_id:
+            if not self.cap.grab():
+                return False
+            self.decoder_pos += 1
+        return True
+
+    def _get(self, frame_id):
+        if not self.goto(frame_id):
+            return None
+        return self.read()
+
+
+class LiveReader(Reader):
+    """
+    Reader for live streams: a grabber thread keeps only the newest frame,
+    so when processing falls behind stale frames are dropped (and counted) instead of piling up.
+    Random access is not supported.
+
+    realtime=True paces a file source by its fps to emulate a camera (e.g. for testing).
+
+    Usage:
+    reader = LiveReader(cv2.VideoCapture("rtsp://..."))
+    frame = reader.read()  # newest frame, waits for the next one if it was already returned
+    print(reader.frame_id, reader.msec, reader.dropped)  # id and timestamp of the returned frame
+    reader.release()
+    """
+
+    def __init__(self, cap, realtime=False, timeout=5.0):
+        super().__init__(cap)
+        self.realtime = realtime
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.stopped = threading.Event()
+        self.frame = None
+        # Кадр и его время от потока захвата, выставляются вместе под блокировкой
+        self.grabbed = (None, 0.0)
+        self.grabbed_id = -1
+        self.frame_id = -1
+        self.msec = 0.0
+        self.dropped = 0
+        self.ended = False
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def read(self):
+        """newest frame or None when the stream ended or no frames came in timeout seconds"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.grabbed_id > self.frame_id or self.ended, self.timeout)
+            if self.grabbed_id <= self.frame_id:
+                return None
+            self.frame_id = self.grabbed_id
+            self.frame, self.msec = self.grabbed
+            return self.frame
+
+    def release(self):
+        self.stopped.set()
+        self.thread.join()
+        self.cap.release()
+
+    def _run(self):
+        period = 1 / (self.cap.get(cv2.CAP_PROP_FPS) or 25)
+        next_time = time.monotonic()
+        while not self.stopped.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+            with self.cond:
+                if self.grabbed_id > self.frame_id:
+                    self.dropped += 1
+                self.grabbed = (frame, msec)
+                self.grabbed_id += 1
+                self.cond.notify_all()
+            if self.realtime:
+                next_time += period
+                time.sleep(max(0.0, next_time - time.monotonic()))
+        with self.cond:
+            self.ended = True
+            self.cond.notify_all()
+
+
+class BufferedReader(Reader):
+    """
+    Reader with a bounded buffer of recently decoded frames
+
+    Small backward and forward steps are served from memory and never call
+    cap.set(CAP_PROP_POS_FRAMES), which makes the decoder go back to the previous keyframe.
+    Returned frames are shared with the buffer, so draw on a copy.
+
+    pos - id of the next frame read() returns (same as CAP_PROP_POS_FRAMES)
+    frame_id - id of the last returned frame
+
+    Usage:
+    reader = BufferedReader(cv2.VideoCapture(video), max_mb=512)
+    frame = reader.read()
+    reader.seek(reader.pos - 3)
+    frame = reader.read()  # from memory
+    print(reader.stats())
+    """
+
+    def __init__(self, cap, max_mb=512, max_skip=30, index=None):
+        super().__init__(cap, index=index, max_skip=max_skip)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.pos = self.decoder_pos
+        self.frame_id = self.pos - 1
+        self.hits = 0
+        self.misses = 0
+
+    def read(self):
+        frame = self.frames.get(self.pos)
+        if frame is not None:
+            self.frames.move_to_end(self.pos)
+            self.hits += 1
+        else:
+            frame = self._decode(self.pos)
+            if frame is None:
+                return None
+            self.misses += 1
+        self.frame_id = self.pos
+        self.pos += 1
+        return frame
+
+    def seek(self, frame_id):
+        self.pos = max(0, int(frame_id))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "seeks": self.seeks,
+                "frames": len(self.frames),
+                "mb": round(self.nbytes / 1024 / 1024, 1)}
+
+    def _get(self, frame_id):
+        self.seek(frame_id)
+        return self.read()
+
+    def _decode(self, frame_id):
+        # close ahead - decode and keep the frames in between, otherwise jump
+        if not self.decoder_pos <= frame_id <= self.decoder_pos + self.max_skip:
+            if not self.goto(frame_id):
+                return None
+
+        while True:
+            decoded_id = self.decoder_pos
+            frame = super().read()
+            if frame is None:
+                return None
+            self._store(decoded_id, frame)
+            if decoded_id >= frame_id:
+                return frame
+
+    def _store(self, frame_id, frame):
+        old = self.frames.pop(frame_id, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self.frames[frame_id] = frame
+        self.nbytes += frame.nbytes
+        while self.nbytes > self.max_bytes and len(self.frames) > 1:
+            _, old = self.frames.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+
+class Prefetcher:
+    """
+    Frame source for the viewer with optional background decoding
+
+    After start() a producer thread decodes frames ahead into a bounded queue
+    and also runs prepare(frame_id, frame) (e.g. drawing the overlay), so the UI thread
+    only shows frames. Without start() frames are read synchronously.
+    While running the thread owns the reader - use seek() of this class, not of the reader.
+
+    Usage:
+    player = Prefetcher(BufferedReader(cap), size=32, prepare=render)
+    player.start()
+    frame_id, frame, prepared = player.read()
+    player.seek(player.pos + 60)
+    player.stop()
+    """
+
+    def __init__(self, reader, size=32, prepare=None):
+        self.reader = reader
+        self.size = size
+        self.prepare = prepare
+        self.pos = reader.pos
+        self.queue = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.reader.seek(self.pos)
+        self.queue = queue.Queue(maxsize=self.size)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """stop decoding ahead and drop queued frames, next read() continues after the last returned frame"""
+        if self.thread is None:
+            return
+        self.stopped.set()
+        while self.thread.is_alive():
+            self._drain()
+            self.thread.join(0.01)
+        self._drain()
+        self.thread = None
+        self.reader.seek(self.pos)
+
+    def read(self):
+        """returns (frame_id, frame, prepared) or (None, None, None) at the end of the video"""
+        if self.thread is not None:
+            item = self.queue.get()
+        else:
+            item = self._next()
+        if item is None:
+            return None, None, None
+        self.pos = item[0] + 1
+        return item
+
+    def seek(self, frame_id):
+        frame_id = max(0, int(frame_id))
+        if self.thread is not None:
+            self.stop()
+            self.pos = frame_id
+            self.start()
+        else:
+            self.pos = frame_id
+            self.reader.seek(frame_id)
+
+    def _next(self):
+        frame = self.reader.read()
+        if frame is None:
+            return None
+        frame_id = self.reader.frame_id
+        prepared = self.prepare(frame_id, frame) if self.prepare else None
+        return frame_id, frame, prepared
+
+    def _run(self):
+        try:
+            while not self.stopped.is_set():
+                item = self._next()
+                self._put(item)
+                if item is None:
+                    return
+        except Exception as e:
+            print("- prefetch error:", e)
+            self._put(None)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.05)
+                return
+            except queue.Full:
+                continue
+
+    def _drain(self):
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
+def dhash(frame, hash_size=8):
+    """difference hash of the frame: hash_size*hash_size bits packed to uint8 array"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(small[:, 1:] > small[:, :-1])
+
+
+class DuplicateFilter:
+    """
+    Near-duplicate check by dHash: a frame is a duplicate if its hash is within
+    threshold bits (Hamming distance) of one of the last kept frames
+
+    Usage:
+    dedup = DuplicateFilter(threshold=5)
+    if dedup.check(frame):
+        cv2.imwrite(path, frame)
+    """
+
+    def __init__(self, threshold=5, history=50, hash_size=8):
+        self.threshold = threshold
+        self.hash_size = hash_size
+        self.hashes = np.zeros((history, hash_size * hash_size // 8), dtype=np.uint8)
+        self.count = 0
+        self.last = -1
+        self.dropped = 0
+
+    def distance(self, frame_hash):
+        """min distance from the hash to the kept ones (None if nothing kept yet)"""
+        if not self.count:
+            return None
+        kept = self.hashes[(self.last - np.arange(self.count)) % len(self.hashes)]
+        diff = np.bitwise_xor(kept, frame_hash)
+        return int(np.unpackbits(diff, axis=1).sum(axis=1).min())
+
+    def check(self, frame):
+        """True and remember the frame if it is new, False if it is a near-duplicate"""
+        frame_hash = dhash(frame, self.hash_size)
+        dist = self.distance(frame_hash)
+        if dist is not None and dist <= self.threshold:
+            self.dropped += 1
+            return False
+        self.add(frame_hash)
+        return True
+
+    def add(self, frame_hash):
+        self.last = (self.last + 1) % len(self.hashes)
+        self.hashes[self.last] = frame_hash
+        self.count = min(self.count + 1, len(self.hashes))
+
+    def pop(self):
+        """forget the last kept frame (e.g. it was deleted)"""
+        if self.count:
+            self.last = (self.last - 1) % len(self.hashes)
+            self.count -= 1
+
+
+# Ядро оценки шума (Immerkaer, 1996)
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+
+def frame_quality(frame, width=320):
+    """
+    Cheap quality scores of the frame, computed on a grayscale copy downscaled to width:
+    sharpness - variance of Laplacian (blurred frames have low values)
+    dark, bright - share of pixels below 16 / above 239
+    brightness - mean intensity
+    noise - estimated noise sigma
+    """
+    # cheap decimation of big frames before the color conversion
+    step = frame.shape[1] // (2 * width)
+    if step > 1:
+        frame = frame[::step, ::step]
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    h, w = gray.shape
+    if w > width:
+        gray = cv2.resize(gray, (width, max(3, int(h * width / w))), interpolation=cv2.INTER_AREA)
+    h, w = gray.shape
+
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel() / gray.size
+    conv = cv2.filter2D(gray.astype(np.float32), -1, _NOISE_KERNEL)[1:-1, 1:-1]
+
+    return {"sharpness": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+            "dark": float(hist[:16].sum()),
+            "bright": float(hist[240:].sum()),
+            "brightness": float(hist @ np.arange(256)),
+            "noise": float(np.abs(conv).sum() * np.sqrt(np.pi / 2) / (6 * (w - 2) * (h - 2)))}
+
+
+def quality_ok(scores, min_sharpness=0.0, max_clipped=1.0, max_noise=0.0):
+    """check frame_quality scores against thresholds, max_noise=0 disables the noise check"""
+    if scores["sharpness"] < min_sharpness:
+        return False
+    if scores["dark"] > max_clipped or scores["bright"] > max_clipped:
+        return False
+    if max_noise and scores["noise"] > max_noise:
+        return False
+    return True
+
+
+def encode_params(ext, quality=None):
+    """
+    cv2.imwrite params for the image extension
+    quality - JPEG/WebP quality 0-100 or PNG compression level 0-9, None for defaults
+    """
+    ext = ext.lower().lstrip(".")
+    if ext in ("jpg", "jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, 95 if quality is None else quality]
+    if ext == "png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, 3 if quality is None else quality]
+    if ext == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, 95 if quality is None else quality]
+    return []
+
+
+class ImageWriter:
+    """
+    Saves images in a thread pool, so encoding doesn't block the caller.
+    Images must not be changed after write().
+
+    Usage:
+    writer = ImageWriter(params=encode_params(".jpg", 90))
+    writer.write(path, frame)
+    writer.remove(path)  # cancels the write if it hasn't started, otherwise waits and deletes the file
+    writer.close()  # waits for all pending writes
+    """
+
+    def __init__(self, workers=2, params=None, max_pending=32):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.params = params or []
+        self.pending = {}
+        self.lock = threading.Lock()
+        # limits memory held by queued frames
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.errors = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, path, img):
+        self.slots.acquire()
+        job = self.pool.submit(self._write, path, img)
+        with self.lock:
+            self.pending[path] = job
+        job.add_done_callback(lambda j: self._done(path, j))
+        return job
+
+    def remove(self, path):
+        """delete the image, raises OSError if it can`t be deleted"""
+        with self.lock:
+            job = self.pending.get(path)
+        if job is not None:
+            if job.cancel():
+                return
+            if job.exception() is not None:
+                raise OSError("{} was not written".format(path))
+        os.remove(path)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+    def _write(self, path, img):
+        if not cv2.imwrite(path, img, self.params):
+            raise OSError("can`t write {}".format(path))
+
+    def _done(self, path, job):
+        self.slots.release()
+        with self.lock:
+            if self.pending.get(path) is job:
+                del self.pending[path]
+        if not job.cancelled() and job.exception() is not None:
+            self.errors += 1
+            print("- {}".format(job.exception()))
+
+
+class VideoLoader:
+    """
+    Opens readers in background threads, so switching to a preloaded video is instant
+
+    Usage:
+    loader = VideoLoader(lambda video: Reader(cv2.VideoCapture(video)))
+    reader = loader.get(video)  # waits if it is still opening
+    loader.preload([next_video, prev_video])
+    loader.close()
+    """
+
+    def __init__(self, opener, workers=2):
+        self.opener = opener
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.jobs = {}
+
+    def get(self, video):
+        job = self.jobs.pop(video, None)
+        if job is None:
+            return self.opener(video)
+        return job.result()
+
+    def preload(self, videos):
+        """start opening videos, release preloaded ones that are not in the list"""
+        for video in list(self.jobs):
+            if video not in videos:
+                self.jobs.pop(video).add_done_callback(self._release)
+        for video in videos:
+            if video not in self.jobs:
+                self.jobs[video] = self.pool.submit(self.opener, video)
+
+    def close(self):
+        self.preload([])
+        self.pool.shutdown(wait=True)
+
+    @staticmethod
+    def _release(job):
+        if not job.cancelled() and job.exception() is None:
+            job.result().cap.release()
+
+
+class Manifest:
+    """
+    Log of frames saved to the dataset folder, stored in <dataset>/manifest.sqlite
+
+    Keeps the next counter value and every saved frame (video, frame id, timestamp, image path),
+    so the folder is not rescanned at startup and saves can be undone one by one.
+
+    Usage:
+    manifest = Manifest(save_path)
+    if manifest.counter is None:
+        manifest.set_counter(scanned_counter)
+    manifest.add(name, video, frame_id, msec)  # increments the counter
+    saved = manifest.saved_frames(video)
+    path, video, frame_id = manifest.pop()  # last save that is not deleted yet
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, "manifest.sqlite")
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER);
+            CREATE TABLE IF NOT EXISTS frames (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                video TEXT NOT NULL,
+                frame INTEGER NOT NULL,
+                msec REAL,
+                saved_at REAL NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS frames_video ON frames (video, frame);
+        """)
+
+    @property
+    def counter(self):
+        row = self.db.execute("SELECT value FROM state WHERE key = 'counter'").fetchone()
+        return row[0] if row else None
+
+    def set_counter(self, counter):
+        with self.db:
+            self._set_counter(counter)
+
+    def add(self, name, video, frame_id, msec=None):
+        self.add_many(video, [(name, frame_id, msec)])
+
+    def add_many(self, video, records, counter=None):
+        """
+        records - [(image name, frame id, msec)]
+        counter - next counter value, by default current value + len(records)
+        """
+        if counter is None:
+            counter = (self.counter or 0) + len(records)
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO frames (name, video, frame, msec, saved_at) VALUES (?, ?, ?, ?, ?)",
+                [(name, self._video_key(video), int(frame_id), msec, now) for name, frame_id, msec in records])
+            self._set_counter(counter)
+
+    def pop(self):
+        """mark the last save deleted, returns (image path, video, frame id) or None"""
+        row = self.db.execute("SELECT id, name, video, frame FROM frames WHERE deleted = 0 "
+                              "ORDER BY id DESC LIMIT 1").fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute("UPDATE frames SET deleted = 1 WHERE id = ?", (row[0],))
+        return os.path.join(self.folder, row[1]), row[2], row[3]
+
+    def saved_frames(self, video):
+        """set of saved frame ids of the video"""
+        rows = self.db.execute("SELECT frame FROM frames WHERE video = ? AND deleted = 0",
+                               (self._video_key(video),))
+        return {row[0] for row in rows}
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def _video_key(video):
+        # stream urls are kept as is
+        return video if "://" in video else os.path.abspath(video)
+
+    def _set_counter(self, counter):
+        self.db.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('counter', ?)", (int(counter),))
+
+
+def proxy_path(video):
+    """path of the proxy video cached in 'proxy' folder next to the source"""
+    folder, name = os.path.split(video)
+    return os.path.join(folder, "proxy", name + ".avi")
+
+
+def make_proxy(video, width=640):
+    """
+    create downscaled all-intra (MJPG) copy of the video with the same frames numbering,
+    reuses the cached proxy if it is newer than the video
+
+    returns proxy path or None if the video can`t be read
+    """
+    path = proxy_path(video)
+    if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(video):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    reader = Reader(cv2.VideoCapture(video))
+    h, w, fps = reader.get_information()
+    if not w:
+        return None
+    size = (width, int(round(h * width / w / 2)) * 2)
+
+    tmp = path + ".tmp.avi"
+    out = cv2.VideoWriter(tmp, cv2.VideoWriter_fourcc(*"MJPG"), fps or 25, size)
+    try:
+        while True:
+            frame = reader.read()
+            if frame is None:
+                break
+            out.write(cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+    finally:
+        out.release()
+        reader.cap.release()
+    os.replace(tmp, path)
+    return path
+
+
+def make_proxies(videos, width=640, workers=None):
+    """
+    create proxies for the list of videos in a process pool
+
+    returns {video: proxy path}
+    """
+    proxies = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = {pool.submit(make_proxy, video, width): video for video in videos}
+        for n, job in enumerate(as_completed(jobs)):
+            video = jobs[job]
+            try:
+                proxies[video] = job.result()
+            except Exception as e:
+                print("- can`t create proxy for {}: {}".format(video, e))
+                proxies[video] = None
+            print("\rproxies {}/{}".format(n + 1, len(jobs)), end="")
+    print()
+    return proxies
+
+
+class Undistorter:
+    """
+    Undistortion by calibration.npz of chessboard_undistort.py
+
+    Remap tables are built once per resolution (camera matrix is scaled if the resolution differs
+    from the calibration one) and cached in compact fixed-point form (CV_16SC2) next to the calibration file.
+
+    Usage:
+    undistorter = Undistorter("calibration.npz")
+    image = undistorter(frame)  # undistorted and cropped to the ROI
+    lines = undistorter.labels(lines, frame.shape[1], frame.shape[0])  # YOLO labels of the frame
+    """
+
+    def __init__(self, calibration, crop=True):
+        self.path = calibration
+        self.crop = crop
+        data = np.load(calibration)
+        self.mtx = data["mtx"]
+        self.dist = data["dist"]
+        self.size = tuple(int(v) for v in data["size"])
+        self.maps = {}
+        self.cameras = {}
+
+    def camera(self, w, h):
+        """(camera matrix, new camera matrix, roi) for the resolution"""
+        if (w, h) not in self.cameras:
+            mtx = self.mtx.copy()
+            mtx[0] *= w / self.size[0]
+            mtx[1] *= h / self.size[1]
+            new_mtx, roi = cv2.getOptimalNewCameraMatrix(mtx, self.dist, (w, h), 1, (w, h))
+            self.cameras[(w, h)] = mtx, new_mtx, tuple(roi)
+        return self.cameras[(w, h)]
+
+    def get_maps(self, w, h):
+        """(map1, map2, roi) for the resolution"""
+        if (w, h) in self.maps:
+            return self.maps[(w, h)]
+
+        path = "{}.{}x{}.maps.npz".format(os.path.splitext(self.path)[0], w, h)
+        mtime = os.stat(self.path).st_mtime_ns
+        if os.path.isfile(path):
+            data = np.load(path)
+            if int(data["mtime"]) == mtime:
+                self.maps[(w, h)] = data["map1"], data["map2"], tuple(int(v) for v in data["roi"])
+                return self.maps[(w, h)]
+
+        mtx, new_mtx, roi = self.camera(w, h)
+        map1, map2 = cv2.initUndistortRectifyMap(mtx, self.dist, None, new_mtx, (w, h), cv2.CV_16SC2)
+        # batch процессы могут строить одни и те же таблицы одновременно
+        tmp = "{}.{}.tmp.npz".format(path, os.getpid())
+        np.savez(tmp, map1=map1, map2=map2, roi=np.array(roi), mtime=np.array(mtime))
+        os.replace(tmp, path)
+        self.maps[(w, h)] = map1, map2, tuple(roi)
+        return self.maps[(w, h)]
+
+    def roi(self, w, h):
+        """(x, y, w, h) of the valid area, whole frame without crop"""
+        return self.get_maps(w, h)[2] if self.crop else (0, 0, w, h)
+
+    def __call__(self, frame):
+        h, w = frame.shape[:2]
+        map1, map2, _ = self.get_maps(w, h)
+        image = cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+        x, y, rw, rh = self.roi(w, h)
+        return image[y:y + rh, x:x + rw]
+
+    def points(self, points, w, h):
+        """pixel points (N, 2) of the distorted frame -> pixel points of the undistorted (cropped) image"""
+        mtx, new_mtx, _ = self.camera(w, h)
+        x, y, _, _ = self.roi(w, h)
+        points = cv2.undistortPoints(np.asarray(points, np.float64).reshape(-1, 1, 2), mtx, self.dist, P=new_mtx)
+        return points.reshape(-1, 2) - (x, y)
+
+    def labels(self, lines, w, h):
+        """
+        YOLO label lines of the w x h frame -> lines for the undistorted image.
+        Boxes are moved by their corners and edge midpoints, polygons by their points,
+        objects left outside the ROI and malformed lines are dropped.
+        Even number of values - the last one is a score, it is kept as is
+        """
+        _, _, rw, rh = self.roi(w, h)
+        result = []
+        for line in lines:
+            values = line.split()
+            if len(values) < 5:
+                continue
+            score = [values.pop()] if len(values) % 2 == 0 else []
+            try:
+                int(values[0])
+                coords = np.array(values[1:], np.float64)
+            except ValueError:
+                continue
+            if len(values) == 5:
+                cx, cy, bw, bh = coords
+                xs = np.array([cx - bw / 2, cx, cx + bw / 2])
+                ys = np.array([cy - bh / 2, cy, cy + bh / 2])
+                grid = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+                pts = self.points(grid * (w, h), w, h)
+                x1, y1 = np.clip(pts.min(axis=0), 0, (rw, rh))
+                x2, y2 = np.clip(pts.max(axis=0), 0, (rw, rh))
+                if x2 - x1 < 1 or y2 - y1 < 1:
+                    continue
+                coords = [(x1 + x2) / 2 / rw, (y1 + y2) / 2 / rh, (x2 - x1) / rw, (y2 - y1) / rh]
+            else:
+                pts = self.points(coords.reshape(-1, 2) * (w, h), w, h)
+                pts = np.clip(pts, 0, (rw, rh)) / (rw, rh)
+                if np.ptp(pts[:, 0]) == 0 or np.ptp(pts[:, 1]) == 0:
+                    continue
+                coords = pts.reshape(-1)
+            result.append(" ".join([values[0]] + ["{:.6f}".format(v) for v in coords] + score))
+        return result
+
 
 def get_filelist(directory, ext, separate=False):
     """
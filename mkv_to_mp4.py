@@ -1,48 +1,416 @@
 from functions import Reader, get_filelist
 
 import os
+import json
+import time
+import shutil
+import argparse
+import queue
+import subprocess
+import threading
 import cv2
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+try:
+    import av
+except ImportError:
+    av = None
 
-def write_video(filename, reader_class, frames_per_sec, show=False):
-    frames_per_sec = max(1, frames_per_sec)
+"""
+Convert all videos in the folder tree to mp4 in a process pool.
+
+If PyAV or ffmpeg binary is available and the codecs can be stored in mp4 (e.g. h264),
+packets are copied into mp4 without decoding. Otherwise frames are re-encoded with OpenCV (mp4v).
+
+Every video is written to a temporary file, renamed only after its frames count is checked,
+and only then the source is deleted. Finished videos are logged to the journal,
+so an interrupted run continues where it stopped.
+If the source is mp4 itself, the result is <name>.converted.mp4, such files are never taken as sources
+and mp4 sources are never deleted.
+
+Usage:
+python mkv_to_mp4.py --videos "/path/to/videos/" --ext ".mkv" --workers 8
+python mkv_to_mp4.py --videos "/path/to/videos/" --every 5 --width 640  # archival copy: 1/5 of frames, 640px
+"""
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Convert videos to mp4")
+    parser.add_argument(
+        "-v",
+        "--videos",
+        type=str,
+        required=True,
+        help="Root dir with videos, searched recursively",
+    )
+
+    parser.add_argument(
+        "-e",
+        "--ext",
+        type=str,
+        default=".mkv",
+        help="Videos extension",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes (default - all cores)",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--journal",
+        type=str,
+        default="",
+        help="Journal file, default - mkv_to_mp4.journal in the videos dir",
+    )
+
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Don't delete source videos",
+    )
+
+    parser.add_argument(
+        "--reencode",
+        action="store_true",
+        help="Always re-encode frames with OpenCV instead of copying packets",
+    )
+
+    parser.add_argument(
+        "--every",
+        type=int,
+        default=1,
+        help="Keep every n-th frame (fps is divided accordingly), implies --reencode",
+    )
+
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=0,
+        help="Resize frames to this width keeping aspect ratio, implies --reencode",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def write_video(filename, reader_class, frames_per_sec, show=False, progress=None, every=1, width=0,
+                buffers=8, stats=None):
+    """
+    Decoder thread reads every n-th frame (resized to width if given) into reusable buffers,
+    the calling thread encodes them.
+    progress(frames written) is called every 500 frames
+    stats - optional dict, filled with {stage: [frames, busy seconds]} of decode/resize/encode
+    returns number of written frames
+    """
+    frames_per_sec = max(1, frames_per_sec / every)
     out = None
+    written = 0
+    timing = {"decode": [0, 0.0], "resize": [0, 0.0], "encode": [0, 0.0]}
+
+    # Пул буферов ограничивает очередь: декодер ждет, пока энкодер не вернет буфер
+    free = queue.Queue()
+    for _ in range(buffers):
+        free.put(None)
+    decoded = queue.Queue()
+    stop = threading.Event()
+    errors = []
 
+    def decode():
+        raw = None
+        try:
+            while not stop.is_set():
+                buffer = free.get()
+                if stop.is_set():
+                    break
+
+                start = time.perf_counter()
+                frame = reader_class.read(raw if width else buffer)
+                # пропущенные кадры только grab(), без конвертации в BGR
+                skipped = 0
+                while frame is not None and skipped < every - 1 and reader_class.cap.grab():
+                    skipped += 1
+                timing["decode"][0] += skipped + (frame is not None)
+                timing["decode"][1] += time.perf_counter() - start
+                if frame is None:
+                    break
+
+                if width:
+                    start = time.perf_counter()
+                    raw = frame
+                    h, w = frame.shape[:2]
+                    frame = cv2.resize(frame, (width, round(h * width / w / 2) * 2), dst=buffer,
+                                       interpolation=cv2.INTER_AREA)
+                    timing["resize"][0] += 1
+                    timing["resize"][1] += time.perf_counter() - start
+                decoded.put(frame)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            decoded.put(None)
+
+    decoder = threading.Thread(target=decode, daemon=True)
+    decoder.start()
     try:
         while True:
-            frame = reader_class.read()
+            frame = decoded.get()
+            if frame is None:
+                break
             if show:
                 cv2.imshow('video', frame)
 
+            start = time.perf_counter()
             if not out:
-                height, width, channels = frame.shape
+                height, frame_width, channels = frame.shape
                 fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                out = cv2.VideoWriter(filename, fourcc, frames_per_sec, (width, height))
-            if frame is None:
-                break
+                out = cv2.VideoWriter(filename, fourcc, frames_per_sec, (frame_width, height))
 
             out.write(frame)
+            timing["encode"][0] += 1
+            timing["encode"][1] += time.perf_counter() - start
+            free.put(frame)
+            written += 1
+            if progress and written % 500 == 0:
+                progress(written)
 
     finally:
+        stop.set()
+        free.put(None)
+        decoder.join()
         out and out.release()
-        cv2.destroyAllWindows()
+        if show:
+            cv2.destroyAllWindows()
+    if errors:
+        raise errors[0]
+    if stats is not None:
+        stats.update(timing)
+    return written
+
+
+# Кодеки, которые можно положить в mp4 без перекодирования
+MP4_VIDEO_CODECS = {"h264", "hevc", "mpeg4", "av1", "vp9"}
+MP4_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "opus", "alac"}
+
+
+def probe_streams(video):
+    """[(stream index, type, codec name)] via PyAV or ffprobe, None if neither is available"""
+    if av is not None:
+        with av.open(video) as container:
+            return [(st.index, st.type, st.codec_context.name) for st in container.streams]
+
+    if shutil.which("ffprobe"):
+        out = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "stream=index,codec_type,codec_name",
+                              "-of", "json", video], capture_output=True, text=True, check=True).stdout
+        return [(st["index"], st.get("codec_type"), st.get("codec_name")) for st in json.loads(out)["streams"]]
+    return None
+
+
+def remux(video, filename):
+    """
+    copy video and mp4 compatible audio packets into filename without decoding
+    returns number of copied video frames or None if it is not possible
+    """
+    if av is None and not (shutil.which("ffmpeg") and shutil.which("ffprobe")):
+        return None
+    streams = probe_streams(video)
+    videos = [st for st in streams if st[1] == "video"]
+    if len(videos) != 1 or videos[0][2] not in MP4_VIDEO_CODECS:
+        return None
+    keep = videos + [st for st in streams if st[1] == "audio" and st[2] in MP4_AUDIO_CODECS]
+
+    if av is not None:
+        return _remux_av(video, filename, [st[0] for st in keep])
+    return _remux_ffmpeg(video, filename, keep)
+
 
+def _remux_av(video, filename, indexes):
+    copied = 0
+    with av.open(video) as src, av.open(filename, "w", format="mp4") as dst:
+        outputs = {}
+        for i in indexes:
+            stream = src.streams[i]
+            if hasattr(dst, "add_stream_from_template"):
+                outputs[i] = dst.add_stream_from_template(stream)
+            else:
+                outputs[i] = dst.add_stream(template=stream)
 
-videos_dir = "/home/mikhail/PycharmProjects/DatasetFromVideo/test"
-videos_list = sorted(get_filelist(os.path.join(videos_dir, "raw"), ext=".mkv"))
+        for packet in src.demux([src.streams[i] for i in indexes]):
+            # empty flush packets of the demuxer
+            if not packet.size:
+                continue
+            is_video = packet.stream.type == "video"
+            packet.stream = outputs[packet.stream.index]
+            dst.mux(packet)
+            copied += is_video
+    return copied
 
-for n, _ in enumerate(videos_list):
-    video = videos_list[n]
-    print("%s/%s  |  %s" % (n+1, len(videos_list), video))
-    save_filename = video.replace(".mkv", ".mp4")
 
+def _remux_ffmpeg(video, filename, streams):
+    cmd = ["ffmpeg", "-v", "error", "-y", "-i", video]
+    for index, _, _ in streams:
+        cmd += ["-map", "0:{}".format(index)]
+    cmd += ["-c", "copy", "-movflags", "+faststart"]
+    if streams[0][2] == "hevc":
+        cmd += ["-tag:v", "hvc1"]
+    subprocess.run(cmd + [filename], check=True)
+
+    out = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+                          "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", video],
+                         capture_output=True, text=True, check=True).stdout
+    return int(out.strip())
+
+
+def frames_count(video):
+    cap = cv2.VideoCapture(video)
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return count
+
+
+def output_path(video, ext):
+    """<name>.mp4, or <name>.converted.mp4 if the source itself is <name>.mp4"""
+    name = video[:-len(ext)] if video.endswith(ext) else video
+    if os.path.abspath(name + ".mp4") == os.path.abspath(video):
+        return name + ".converted.mp4"
+    return name + ".mp4"
+
+
+def removable(video):
+    """source can be deleted after conversion: mp4 sources are always kept"""
+    return not video.lower().endswith(".mp4")
+
+
+def is_output(video):
+    """converted or temporary files, they are never taken as sources"""
+    return video.endswith((".converted.mp4", ".part.mp4"))
+
+
+def encode(video, filename, every=1, width=0):
+    """re-encode frames with OpenCV, returns number of written frames"""
     reader = Reader(cv2.VideoCapture(video))
     h, w, fps = reader.get_information()
+    total = -(-int(reader.cap.get(cv2.CAP_PROP_FRAME_COUNT)) // every)
+    name = os.path.basename(video)
+
+    def progress(written):
+        print("    {} {}%".format(name, int(100 * written / total) if total else written))
+
+    stats = {}
+    try:
+        written = write_video(filename, reader, fps, progress=progress, every=every, width=width, stats=stats)
+    finally:
+        reader.cap.release()
+    # Самая медленная стадия - узкое место
+    print("    {}  {}".format(name, ", ".join("{} {:.0f} fps".format(stage, frames / seconds)
+                                            for stage, (frames, seconds) in stats.items() if seconds)))
+    return written
+
+
+def check_frames(written, source_frames, every=1):
+    """
+    written frames match the source frames count (ceil(source / every) for decimation),
+    container estimates of the source count may be off by a frame or two
+    """
+    expected = -(-source_frames // every)
+    return abs(written - expected) <= max(2, expected // 100)
+
+
+def convert(video, ext, reencode=False, every=1, width=0):
+    """
+    convert one video: temporary file -> frames count check against the source -> rename
+    returns (frames, seconds, "remux" or "encode")
+    """
+    start = time.time()
+    save_filename = output_path(video, ext)
+    tmp_filename = save_filename[:-len(".mp4")] + ".part.mp4"
+    source_frames = frames_count(video)
+
+    written = None
+    mode = "remux"
+    if not reencode and every == 1 and not width:
+        try:
+            written = remux(video, tmp_filename)
+        except Exception as e:
+            print("    {} can`t be copied ({}), re-encoding".format(os.path.basename(video), e))
+    if written is None:
+        mode = "encode"
+        written = encode(video, tmp_filename, every, width)
+
+    # Декодирование могло оборваться раньше конца источника
+    if not written or frames_count(tmp_filename) != written or not check_frames(written, source_frames, every):
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise RuntimeError("frames count check failed: {} frames written, source has {}".format(
+            written, source_frames))
+
+    os.replace(tmp_filename, save_filename)
+    return written, time.time() - start, mode
+
+
+def read_journal(journal):
+    """{absolute video path: record} of finished videos"""
+    done = {}
+    if os.path.isfile(journal):
+        with open(journal) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # last line of an interrupted run
+                    continue
+                done[os.path.abspath(record["video"])] = record
+    return done
+
+
+def write_journal(journal, record):
+    with open(journal, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def main(opt):
+    journal = opt.journal or os.path.join(opt.videos, "mkv_to_mp4.journal")
+    done = read_journal(journal)
+
+    videos_list = sorted(video for video in get_filelist(opt.videos, ext=opt.ext) if not is_output(video))
+    todo = []
+    for video in videos_list:
+        # Ключ журнала - абсолютный путь, --videos можно указать по-разному
+        key = os.path.abspath(video)
+        if key in done and os.path.exists(done[key]["output"]):
+            # converted but not deleted before the interruption
+            if not opt.keep and removable(video):
+                os.remove(video)
+                print(video, "removed")
+            continue
+        todo.append(video)
+
+    print("videos: {}, already converted: {}".format(len(videos_list), len(videos_list) - len(todo)))
+
+    with ProcessPoolExecutor(max_workers=opt.workers) as pool:
+        jobs = {pool.submit(convert, video, opt.ext, opt.reencode, opt.every, opt.width): video for video in todo}
+        for n, job in enumerate(as_completed(jobs)):
+            video = jobs[job]
+            try:
+                written, seconds, mode = job.result()
+            except Exception as e:
+                print("%s/%s  |  %s  failed: %s" % (n + 1, len(jobs), video, e))
+                continue
+            # Источник удаляется только после записи в журнал
+            write_journal(journal, {"video": os.path.abspath(video),
+                                    "output": os.path.abspath(output_path(video, opt.ext)), "frames": written, "seconds": round(seconds, 1), "mode": mode})
+            print("%s/%s  |  %s  %s %s frames, %.1f fps" % (n + 1, len(jobs), video, mode, written,
+                                                            written / max(seconds, 1e-3)))
+            # mp4 источник не удаляется, даже если результат уменьшен (--every, --width)
+            if not opt.keep and removable(video):
+                os.remove(video)
+                print(video, "removed")
 
-    write_video(save_filename, reader, fps)
 
-    if os.path.exists(video):
-        os.remove(video)
-        print(video, "removed")
-    else:
-        print("The file does not exist")
+if __name__ == "__main__":
+    main(get_args())
@@ -1,5 +1,11 @@
 from functions import *
+from catalog import Catalog
 import argparse
+import json
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import cv2
 import glob
 """
@@ -11,9 +17,21 @@ U/I - Перемотка на +/- 10000 кадров
 ,/. - Предыдущее/Следующее видео
 
 S - Сохранить фрэйм
-D - Удалить последний сохранённый фрейм
+D - Удалить последний сохранённый фрейм (повторное нажатие - предыдущий)
+
+M - Отметить/снять отметку с кадра
+[/] - Начало/конец отрезка: отмечается каждый --mark-step кадр
+Отметки сохраняются в marks.json: {"video.mp4": [номера кадров]}
 
 Q - Закончить просмотр
+
+--batch - сохранить кадры без просмотра: каждый N-й (--every) или раз в T секунд (--interval)
+--batch --from-marks - сохранить отмеченные кадры в полном разрешении
+
+--undistort calibration.npz - сохранять кадры без дисторсии (см. chessboard_undistort.py)
+
+--live - поток с камеры (url или номер устройства): показываются только свежие кадры, S/D/Q работают как обычно,
+         с --every/--interval кадры сохраняются автоматически, с --batch - без окна
 """
 
 
@@ -42,12 +60,177 @@ def get_args():
         help="Skip videos to start from another time. Format - \"hh:mm:ss\"",
     )
 
+    parser.add_argument(
+        "-c",
+        "--cache",
+        type=int,
+        default=512,
+        help="Memory limit (MB) for recently decoded frames used by rewind keys",
+    )
+
+    parser.add_argument(
+        "--no-index",
+        action="store_true",
+        help="Don't build/use keyframe index files (<video>.idx.npz) for frame-exact jumps",
+    )
+
+    parser.add_argument(
+        "--proxy",
+        type=int,
+        default=0,
+        help="Browse downscaled proxy videos of this width (cached in 'proxy' folder), "
+             "S saves the full resolution frame from the original video",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes for background jobs (default - all cores)",
+    )
+
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Save frames from all videos without the viewer, see --every/--interval",
+    )
+
+    parser.add_argument(
+        "--every",
+        type=int,
+        default=0,
+        help="Batch mode: save every N-th frame",
+    )
+
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0,
+        help="Batch mode: save one frame every T seconds",
+    )
+
+    parser.add_argument(
+        "--dedup",
+        type=int,
+        default=-1,
+        help="Skip frames within this Hamming distance (bits of 64-bit dHash) of recently saved ones, "
+             "e.g. 5. Disabled by default",
+    )
+
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default="jpg",
+        choices=["jpg", "png", "webp"],
+        help="Saved images format",
+    )
+
+    parser.add_argument(
+        "-q",
+        "--quality",
+        type=int,
+        default=None,
+        help="JPEG/WebP quality (0-100, default 95) or PNG compression level (0-9, default 3)",
+    )
+
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=1280,
+        help="Initial width of the viewer window, frames are downscaled to the window size before drawing",
+    )
+
+    parser.add_argument(
+        "--marks",
+        type=str,
+        default="",
+        help="Marks file, default - marks.json in dataset folder",
+    )
+
+    parser.add_argument(
+        "--mark-step",
+        type=int,
+        default=1,
+        help="Mark every k-th frame of [/] ranges",
+    )
+
+    parser.add_argument(
+        "--from-marks",
+        action="store_true",
+        help="Batch mode: save frames listed in the marks file",
+    )
+
+    parser.add_argument(
+        "--seek-threshold",
+        type=int,
+        default=100,
+        help="Batch mode with marks: decode forward instead of seeking for gaps up to this number of frames "
+             "(used when the video has no keyframe index)",
+    )
+
+    parser.add_argument(
+        "--min-sharpness",
+        type=float,
+        default=0,
+        help="Batch mode: skip blurred frames with lower sharpness score (variance of Laplacian, shown in the viewer)",
+    )
+
+    parser.add_argument(
+        "--max-clipped",
+        type=float,
+        default=1,
+        help="Batch mode: skip over/under-exposed frames with a larger share of too dark or too bright pixels",
+    )
+
+    parser.add_argument(
+        "--max-noise",
+        type=float,
+        default=0,
+        help="Batch mode: skip frames with higher noise score. Disabled by default",
+    )
+
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="--videos is a live stream (url, device number or a file played back in real time)",
+    )
+
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Live mode: play a video file at its fps to emulate a camera",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="dataset",
+        help="Live mode: folder for saved frames",
+    )
+
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        default="",
+        help="Catalog database (see catalog.py): videos metadata is taken from it, saved frames are added to it",
+    )
+
+    parser.add_argument(
+        "--undistort",
+        type=str,
+        default="",
+        help="calibration.npz from chessboard_undistort.py: saved frames are undistorted and cropped",
+    )
+
     args = parser.parse_args()
     return args
 
 
-def main(data_path, file_extension, skip_to=""):
-
+def get_videos(data_path, file_extension):
+    """returns (save_path, videos_list)"""
     if file_extension in data_path:
         save_path = os.path.join(os.path.split(data_path)[0], "dataset")
         videos_list = [data_path]
@@ -55,49 +238,206 @@ def main(data_path, file_extension, skip_to=""):
         save_path = os.path.join(data_path, "dataset")
         # videos_list = sorted(get_filelist(os.path.join(data_path, "raw"), ext=file_extension))
         videos_list = glob.glob(f"{data_path}/*{file_extension}")
+    return save_path, videos_list
+
+
+def get_counter(save_path):
+    """next free number for <video>_<counter>.<jpg|png|webp>"""
+    counter = 0
+    already_saved_imgs = get_filelist(save_path, (".jpg", ".png", ".webp"))
+    for img_name in already_saved_imgs:
+        counter = max(counter, int(os.path.splitext(img_name)[0].split("_")[-1])) + 1
+    return counter
+
+
+def open_manifest(save_path):
+    """Manifest of the dataset folder, the folder is scanned only when the manifest is created"""
+    manifest = Manifest(save_path)
+    if manifest.counter is None:
+        manifest.set_counter(get_counter(save_path))
+    return manifest
+
+
+def load_marks(marks_path):
+    """{video name: set of frame ids}"""
+    if not os.path.isfile(marks_path):
+        return {}
+    with open(marks_path) as f:
+        return {name: set(frame_ids) for name, frame_ids in json.load(f).items()}
+
+
+def save_marks(marks_path, marks):
+    tmp = marks_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({name: sorted(frame_ids) for name, frame_ids in marks.items() if frame_ids}, f, indent=1)
+    os.replace(tmp, marks_path)
+
+
+def quality_thresholds(opt):
+    """kwargs of quality_ok for the thresholds set on the command line, None if all are default (checks disabled)"""
+    thresholds = {}
+    if opt.min_sharpness > 0:
+        thresholds["min_sharpness"] = opt.min_sharpness
+    if opt.max_clipped < 1:
+        thresholds["max_clipped"] = opt.max_clipped
+    if opt.max_noise > 0:
+        thresholds["max_noise"] = opt.max_noise
+    return thresholds or None
+
+
+def skip_to_msec(skip_to):
+    """"hh:mm:ss" -> msec"""
+    h, m, s = map(int, skip_to.split(":"))
+    return (((h * 60) + m) * 60 + s) * 1000
+
+
+def render(frame, frame_id, frames, saved=(), size=None, marked=()):
+    """
+    Image for the viewer window: the frame is downscaled once to fit size (w, h)
+    and the overlay is drawn on the small copy. Decoded frame stays untouched for saving
+    """
+    h, w = frame.shape[:2]
+    scale = min(size[0] / w, size[1] / h) if size else 1
+    if scale < 1:
+        show_img = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    else:
+        show_img = frame.copy()
+
+    # Оценки качества считаются по уже уменьшенному кадру
+    scores = frame_quality(show_img)
+
+    font_scale = max(0.5, show_img.shape[0] / 1000)
+    thickness = max(1, int(font_scale * 2.5))
+    cv2.putText(show_img, "frame {}/{}".format(frame_id + 1, frames),
+                (5, show_img.shape[0] - int(25 * font_scale)), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 255),
+                thickness)
+    cv2.putText(show_img, "sharp {:.0f} dark {:.2f} bright {:.2f} noise {:.1f}".format(
+                    scores["sharpness"], scores["dark"], scores["bright"], scores["noise"]),
+                (5, show_img.shape[0] - int(65 * font_scale)), cv2.FONT_HERSHEY_SIMPLEX, font_scale * 0.6,
+                (255, 255, 255), max(1, thickness // 2))
+    if frame_id in saved:
+        cv2.putText(show_img, "saved", (5, int(35 * font_scale)), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 255, 0),
+                    thickness)
+    if frame_id in marked:
+        cv2.putText(show_img, "marked", (5, int(75 * font_scale)), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+                    (0, 255, 255), thickness)
+    return show_img
+
+
+def open_video(source, cache_mb=512, use_index=True, skip_to=""):
+    """Reader for the viewer with --skip applied and the first frame already decoded"""
+    # Индекс ключевых кадров строится в фоне один раз и сохраняется рядом с видео
+    index = FrameIndex(source).open() if use_index else None
+    reader = BufferedReader(cv2.VideoCapture(source), max_mb=cache_mb, index=index)
+
+    if skip_to:
+        msec = skip_to_msec(skip_to)
+        frame_skip_id = index.frame_at(msec) if index is not None else None
+        if frame_skip_id is None:
+            frame_skip_id = msec * reader.cap.get(cv2.CAP_PROP_FPS) / 1000
+        reader.seek(frame_skip_id)
+
+    if reader.read() is not None:
+        reader.seek(reader.frame_id)
+    return reader
+
+
+def main(data_path, file_extension, skip_to="", cache_mb=512, use_index=True, proxy_width=0, workers=None,
+         dedup=-1, img_format="jpg", quality=None, window_width=1280, marks_path="", mark_step=1, catalog_path="",
+         calibration=""):
+
+    save_path, videos_list = get_videos(data_path, file_extension)
+
+    # Уменьшенные копии видео для быстрой перемотки
+    proxies = make_proxies(videos_list, proxy_width, workers) if proxy_width else {}
 
-    last_saved = None
     waitKey_mode = 0
 
+    # Отсев почти одинаковых кадров при сохранении
+    dup_filter = DuplicateFilter(dedup) if dedup >= 0 else None
+    dup_frame = None
+
     os.makedirs(save_path, exist_ok=True)
 
-    # Счётчик для сохранённых фреймов
-    counter = 0
-    already_saved_imgs = get_filelist(save_path, ".jpg")
-    for img_name in already_saved_imgs:
-        counter = max(counter, int(img_name.split("_")[-1].replace(".jpg", ""))) + 1
+    # Счётчик и список сохранённых фреймов
+    manifest = open_manifest(save_path)
+    counter = manifest.counter
+
+    # Отметки кадров для последующего извлечения в batch режиме
+    marks_path = marks_path or os.path.join(save_path, "marks.json")
+    marks = load_marks(marks_path)
+    mark_in = None
+
+    # Запись файлов идёт в фоне, при выходе дожидаемся всех
+    writer = ImageWriter(params=encode_params(img_format, quality))
+
+    # Окно создаётся один раз, размер окна обновляется при каждом кадре
+    cv2.namedWindow("image", cv2.WINDOW_NORMAL)
+    view_size = []
+
+    # Соседние видео открываются заранее в фоне
+    loader = VideoLoader(lambda v: open_video(proxies.get(v) or v, cache_mb, use_index, skip_to))
+
+    # Метаданные видео из каталога вместо повторного чтения из файла
+    catalog = Catalog(catalog_path) if catalog_path else None
+
+    undistorter = Undistorter(calibration) if calibration else None
+
+    def close():
+        writer.close()
+        manifest.close()
+        loader.close()
+        if catalog is not None:
+            catalog.import_manifest(save_path)
+            catalog.close()
 
     video_id = 0
     for n, _ in enumerate(videos_list):
         video = videos_list[video_id]
 
-        reader = Reader(cv2.VideoCapture(video))
+        source = proxies.get(video) or video
+        full_reader = None
 
-        frames = int(reader.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        reader = loader.get(video)
+        index = reader.index
+        loader.preload([videos_list[i] for i in (video_id + 1, video_id - 1) if 0 <= i < len(videos_list)])
+
+        if catalog is not None:
+            info = catalog.video(video)
+            frames, fps = info["frames"], info["fps"] or 25
+        else:
+            frames = int(reader.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = reader.cap.get(cv2.CAP_PROP_FPS) or 25
         print(video, "frames total:", frames)
 
-        if skip_to:
-            h, m, s = map(int, skip_to.split(":"))
-            fps = int(reader.cap.get(cv2.CAP_PROP_FPS))
-            frame_skip_id = (((h * 60) + m) * 60) * fps
-            reader.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=int(frame_skip_id))
+        if not view_size:
+            h, w, _ = reader.get_information()
+            view_size[:] = [window_width, int(window_width * h / w) if w else window_width]
+            cv2.resizeWindow("image", *view_size)
+
+        saved = manifest.saved_frames(video)
+        marked = marks.setdefault(os.path.basename(video), set())
+
+        # В режиме проигрывания кадры декодируются заранее в отдельном потоке
+        player = Prefetcher(reader, prepare=lambda i, fr: render(fr, i, frames, saved, view_size, marked))
 
         while True:
 
-            frame = reader.read()
+            if waitKey_mode == 1:
+                player.start()
+
+            frame_id, frame, show_img = player.read()
 
             if frame is None:
                 break
 
-            frame_id = int(reader.cap.get(cv2.CAP_PROP_POS_FRAMES))
-
-            save_img = frame.copy()
+            save_img = frame
 
-            cv2.putText(frame, "frame {}/{}".format(frame_id, frames),
-                        (5, frame.shape[0] - 50), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 5)
+            cv2.imshow("image", show_img)
 
-            cv2.namedWindow("image", cv2.WINDOW_NORMAL)
-            cv2.imshow("image", frame)
+            rect = cv2.getWindowImageRect("image")
+            if rect[2] > 0 and rect[3] > 0:
+                view_size[:] = rect[2:]
 
             key = cv2.waitKey(waitKey_mode) & 0xff
             if key == ord('p'):
@@ -106,39 +446,40 @@ def main(data_path, file_extension, skip_to=""):
                     print("- play")
                 elif waitKey_mode == 1:
                     waitKey_mode = 0
+                    player.stop()
                     print("- pause")
 
             # Перемотка назад на -1 кадр
             if key == ord('c'):
-                reader.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=int(reader.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 3)
+                player.seek(player.pos - 3)
 
             # Перемотка вперед на +1 кадр
             if key == ord('v'):
-                reader.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=int(reader.cap.get(cv2.CAP_PROP_POS_FRAMES)) + 3)
+                player.seek(player.pos + 3)
 
             # Перемотка назад на -n кадров
             if key == ord('z'):
-                reader.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=int(reader.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 60)
+                player.seek(player.pos - 60)
 
             # Перемотка вперед на +n кадров
             if key == ord('x'):
-                reader.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=int(reader.cap.get(cv2.CAP_PROP_POS_FRAMES)) + 60)
+                player.seek(player.pos + 60)
 
             # Перемотка назад на -n кадров
             if key == ord('b'):
-                reader.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=int(reader.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 600)
+                player.seek(player.pos - 600)
 
             # Перемотка вперед на +n кадров
             if key == ord('n'):
-                reader.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=int(reader.cap.get(cv2.CAP_PROP_POS_FRAMES)) + 600)
+                player.seek(player.pos + 600)
 
             # Перемотка назад на -n кадров
             if key == ord('i'):
-                reader.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=int(reader.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 10000)
+                player.seek(player.pos - 10000)
 
             # Перемотка вперед на +n кадров
             if key == ord('u'):
-                reader.cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=int(reader.cap.get(cv2.CAP_PROP_POS_FRAMES)) + 10000)
+                player.seek(player.pos + 10000)
 
             # Предыдущее видео
             if key == ord(','):
@@ -151,27 +492,318 @@ def main(data_path, file_extension, skip_to=""):
 
             # Сохранить фрейм
             if key == ord('s'):
-                save_name = "{}_{}.jpg".format(os.path.basename(video).replace(file_extension, ""), counter)
-                last_saved = os.path.join(save_path, save_name)
+                # В режиме proxy сохраняем кадр исходного разрешения
+                if source != video:
+                    if full_reader is None:
+                        full_reader = Reader(cv2.VideoCapture(video),
+                                             index=FrameIndex(video).open() if use_index else None)
+                    save_img = full_reader[frame_id]
+                    if save_img is None:
+                        print("- can`t read frame {} from {}".format(frame_id, video))
+                        continue
+
+                # Повторное нажатие S на том же кадре сохраняет его в любом случае
+                if dup_filter is not None and not dup_filter.check(save_img):
+                    if dup_frame != (video, frame_id):
+                        dup_frame = (video, frame_id)
+                        print("- near-duplicate of a recently saved frame, press S again to save anyway")
+                        continue
+                    dup_filter.add(dhash(save_img, dup_filter.hash_size))
+
+                if undistorter is not None:
+                    save_img = undistorter(save_img)
+
+                save_name = "{}_{}.{}".format(os.path.basename(video).replace(file_extension, ""), counter, img_format)
                 print("- img saved to {}".format(os.path.join(save_path, save_name)))
-                cv2.imwrite(os.path.join(save_path, save_name), save_img)
+                writer.write(os.path.join(save_path, save_name), save_img)
+                msec = index.msec(frame_id) if index is not None else None
+                manifest.add(save_name, video, frame_id, frame_id * 1000 / fps if msec is None else msec)
+                saved.add(frame_id)
                 counter += 1
 
-            # Удалить последний сохраненный фрейм
+            # Удалить последний сохраненный фрейм, повторное нажатие удаляет предыдущий
             if key == ord('d'):
-                try:
-                    os.remove(last_saved)
-                    print("- {} deleted".format(last_saved))
-                except:
-                    print("- Can`t delete {}".format(last_saved))
+                last = manifest.pop()
+                if last is None:
+                    print("- Nothing to delete")
+                else:
+                    last_saved, last_video, last_frame = last
+                    if last_video == os.path.abspath(video):
+                        saved.discard(last_frame)
+                    try:
+                        writer.remove(last_saved)
+                        print("- {} deleted".format(last_saved))
+                        if dup_filter is not None:
+                            dup_filter.pop()
+                    except:
+                        print("- Can`t delete {}".format(last_saved))
+
+            # Отметить кадр
+            if key == ord('m'):
+                if frame_id in marked:
+                    marked.discard(frame_id)
+                    print("- frame {} unmarked".format(frame_id))
+                else:
+                    marked.add(frame_id)
+                    print("- frame {} marked".format(frame_id))
+                save_marks(marks_path, marks)
+
+            # Начало отрезка
+            if key == ord('['):
+                mark_in = (video, frame_id)
+                print("- range start {}".format(frame_id))
+
+            # Конец отрезка
+            if key == ord(']'):
+                if mark_in is None or mark_in[0] != video:
+                    print("- Set range start with [ first")
+                else:
+                    start, end = sorted((mark_in[1], frame_id))
+                    marked.update(range(start, end + 1, max(1, mark_step)))
+                    print("- frames {}-{} marked with step {}".format(start, end, mark_step))
+                    mark_in = None
+                    save_marks(marks_path, marks)
 
             if key == ord('q'):
                 print("Aborting")
+                close()
                 exit(1)
 
+        player.stop()
+        reader.cap.release()
+        print("frames cache:", reader.stats())
         video_id += 1
         print()
 
+    close()
+
+
+# Общий для процессов batch режима счётчик сохранённых фреймов
+_counter = None
+
+
+def _init_worker(counter):
+    global _counter
+    _counter = counter
+
+
+def _next_counter():
+    with _counter.get_lock():
+        value = _counter.value
+        _counter.value += 1
+    return value
+
+
+def extract_frames(video, save_path, file_extension, every=0, interval=0.0, skip_to="", dedup=-1,
+                   img_format="jpg", quality=None, thresholds=None, calibration=""):
+    """
+    Save every N-th frame or one frame every T seconds of the video.
+    Unneeded frames are only grabbed, without retrieving them.
+    With thresholds (kwargs of quality_ok) blurred, badly exposed or noisy frames are skipped.
+    With dedup >= 0 near-duplicates of recently saved frames are skipped.
+    With calibration saved frames are undistorted.
+
+    returns ([(image name, frame id, msec)], stats)
+    """
+    cap = cv2.VideoCapture(video)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    step = every if every else max(interval * fps, 1)
+    name = os.path.basename(video).replace(file_extension, "")
+
+    frame_id = 0
+    if skip_to:
+        frame_id = int(skip_to_msec(skip_to) * fps / 1000)
+        cap.set(propId=cv2.CAP_PROP_POS_FRAMES, value=frame_id)
+
+    dup_filter = DuplicateFilter(dedup) if dedup >= 0 else None
+    undistorter = Undistorter(calibration) if calibration else None
+    writer = ImageWriter(params=encode_params(img_format, quality))
+    saved = []
+    rejected = 0
+    next_id = frame_id
+    try:
+        while cap.grab():
+            if frame_id >= next_id:
+                next_id += step
+                ret, frame = cap.retrieve()
+                if ret and thresholds and not quality_ok(frame_quality(frame), **thresholds):
+                    rejected += 1
+                elif ret and (dup_filter is None or dup_filter.check(frame)):
+                    save_name = "{}_{}.{}".format(name, _next_counter(), img_format)
+                    writer.write(os.path.join(save_path, save_name), frame if undistorter is None else undistorter(frame))
+                    saved.append((save_name, frame_id, cap.get(cv2.CAP_PROP_POS_MSEC)))
+            frame_id += 1
+    finally:
+        cap.release()
+        writer.close()
+    return saved, {"rejected": rejected, "duplicates": dup_filter.dropped if dup_filter is not None else 0}
+
+
+def extract_marked(video, frame_ids, save_path, file_extension, seek_threshold=100, img_format="jpg", quality=None,
+                   calibration=""):
+    """
+    Save listed frames of the video in full resolution.
+    Frames are visited in sorted order: gaps are decoded forward and the decoder seeks only
+    when it is cheaper - past a keyframe (if the video has a keyframe index) or past seek_threshold frames.
+
+    returns ([(image name, frame id, msec)], stats)
+    """
+    index = FrameIndex(video)
+    reader = Reader(cv2.VideoCapture(video), index=index if index.load() else None, max_skip=seek_threshold)
+    name = os.path.basename(video).replace(file_extension, "")
+
+    undistorter = Undistorter(calibration) if calibration else None
+    writer = ImageWriter(params=encode_params(img_format, quality))
+    saved = []
+    try:
+        for frame_id in sorted(set(frame_ids)):
+            frame = reader[frame_id]
+            if frame is None:
+                break
+            if undistorter is not None:
+                frame = undistorter(frame)
+            save_name = "{}_{}.{}".format(name, _next_counter(), img_format)
+            writer.write(os.path.join(save_path, save_name), frame)
+            saved.append((save_name, frame_id, reader.cap.get(cv2.CAP_PROP_POS_MSEC)))
+    finally:
+        reader.cap.release()
+        writer.close()
+    return saved, {"seeks": reader.seeks}
+
+
+def batch_main(data_path, file_extension, every=0, interval=0.0, skip_to="", workers=None, dedup=-1,
+               img_format="jpg", quality=None, marks_path=None, seek_threshold=100, thresholds=None, catalog_path="",
+               calibration=""):
+    """marks_path - save frames from the marks file instead of every N-th frame"""
+    if marks_path is None and not every and not interval:
+        raise ValueError("Set --every, --interval or --from-marks for batch mode")
+
+    save_path, videos_list = get_videos(data_path, file_extension)
+    os.makedirs(save_path, exist_ok=True)
+
+    if marks_path is not None:
+        marks = load_marks(marks_path or os.path.join(save_path, "marks.json"))
+        # В файле отметок только имена видео - ищем их среди --videos
+        videos = {os.path.basename(video): video for video in videos_list}
+        for name in marks:
+            if name not in videos:
+                print("- {} from marks not found in {}".format(name, data_path))
+        tasks = {videos[name]: (extract_marked, (videos[name], frame_ids, save_path, file_extension, seek_threshold,
+                                                 img_format, quality, calibration))
+                 for name, frame_ids in marks.items() if name in videos and frame_ids}
+    else:
+        tasks = {video: (extract_frames, (video, save_path, file_extension, every, interval, skip_to, dedup,
+                                          img_format, quality, thresholds, calibration))
+                 for video in videos_list}
+
+    # Один процесс на видео
+    manifest = open_manifest(save_path)
+    counter = multiprocessing.Value("q", manifest.counter)
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(counter,)) as pool:
+        jobs = {pool.submit(func, *args): video for video, (func, args) in tasks.items()}
+        for n, job in enumerate(as_completed(jobs)):
+            video = jobs[job]
+            try:
+                saved, stats = job.result()
+            except Exception as e:
+                print("{}/{} {} failed: {}".format(n + 1, len(jobs), video, e))
+                continue
+            manifest.add_many(video, saved, counter=counter.value)
+            total += len(saved)
+            print("{}/{} {} frames saved: {}, {}".format(n + 1, len(jobs), video, len(saved), stats))
+
+    # Номера из упавших процессов тоже считаются занятыми
+    manifest.set_counter(counter.value)
+    manifest.close()
+
+    if catalog_path:
+        catalog = Catalog(catalog_path)
+        catalog.scan(videos_list, workers)
+        catalog.import_manifest(save_path)
+        catalog.close()
+    print("Done, {} frames saved to {}".format(total, save_path))
+
+
+def live_main(source, save_path, every=0, interval=0.0, show=True, realtime=False, dedup=-1,
+              img_format="jpg", quality=None, thresholds=None, window_width=1280, calibration=""):
+    """
+    Save frames from a live stream. Only the newest frame is processed, stale ones are dropped.
+    every/interval - save every N-th grabbed frame or one frame every T seconds automatically
+    show - viewer window with S/D/Q keys
+    calibration - calibration.npz to undistort saved frames
+    """
+    os.makedirs(save_path, exist_ok=True)
+    manifest = open_manifest(save_path)
+    counter = manifest.counter
+    writer = ImageWriter(params=encode_params(img_format, quality))
+    dup_filter = DuplicateFilter(dedup) if dedup >= 0 else None
+    undistorter = Undistorter(calibration) if calibration else None
+
+    reader = LiveReader(cv2.VideoCapture(int(source) if source.isdigit() else source), realtime=realtime)
+    name = re.sub(r"[^\w.-]", "_", os.path.splitext(os.path.basename(source.rstrip("/")))[0]) or "live"
+
+    if show:
+        cv2.namedWindow("image", cv2.WINDOW_NORMAL)
+        cv2.resizeWindow("image", window_width, window_width * 9 // 16)
+
+    next_id = 0
+    next_time = time.monotonic()
+    last_report = time.monotonic()
+    try:
+        while True:
+            frame = reader.read()
+            if frame is None:
+                print("Stream ended")
+                break
+            frame_id = reader.frame_id
+
+            key = -1
+            if show:
+                rect = cv2.getWindowImageRect("image")
+                cv2.imshow("image", render(frame, frame_id, "live", size=rect[2:] if rect[2] > 0 else None))
+                key = cv2.waitKey(1) & 0xff
+
+            auto = False
+            if every and frame_id >= next_id:
+                next_id = frame_id + every
+                auto = True
+            if interval and time.monotonic() >= next_time:
+                next_time += interval
+                auto = True
+
+            if key == ord('s') or auto:
+                if thresholds and not quality_ok(frame_quality(frame), **thresholds):
+                    pass
+                elif dup_filter is None or dup_filter.check(frame) or key == ord('s'):
+                    save_name = "{}_{}.{}".format(name, counter, img_format)
+                    writer.write(os.path.join(save_path, save_name), frame if undistorter is None else undistorter(frame))
+                    manifest.add(save_name, source, frame_id, reader.msec)
+                    print("- img saved to {}".format(os.path.join(save_path, save_name)))
+                    counter += 1
+
+            if key == ord('d'):
+                last = manifest.pop()
+                try:
+                    writer.remove(last[0])
+                    print("- {} deleted".format(last[0]))
+                except:
+                    print("- Can`t delete {}".format(last and last[0]))
+
+            if key == ord('q'):
+                break
+
+            if time.monotonic() - last_report > 10:
+                last_report = time.monotonic()
+                print("frames {}, dropped {}".format(reader.frame_id + 1, reader.dropped))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.release()
+        writer.close()
+        manifest.close()
+        print("frames {}, dropped {}".format(reader.frame_id + 1, reader.dropped))
+
 
 if __name__ == "__main__":
     # Папка с исходными видео с соответствующим расширением
@@ -181,7 +813,24 @@ if __name__ == "__main__":
     skip_to = ""
 
     options = get_args()
-    if options.videos is not None:
-        main(options.videos, options.ext, skip_to=options.skip)
+    if options.videos is not None and options.live:
+        live_main(options.videos, options.output, every=options.every, interval=options.interval,
+                  show=not options.batch, realtime=options.realtime, dedup=options.dedup,
+                  img_format=options.format, quality=options.quality,
+                  thresholds=quality_thresholds(options),
+                  window_width=options.window, calibration=options.undistort)
+    elif options.videos is not None and options.batch:
+        batch_main(options.videos, options.ext, every=options.every, interval=options.interval,
+                   skip_to=options.skip, workers=options.workers, dedup=options.dedup,
+                   img_format=options.format, quality=options.quality,
+                   marks_path=options.marks if options.from_marks else None, seek_threshold=options.seek_threshold,
+                   thresholds=quality_thresholds(options),
+                   catalog_path=options.catalog, calibration=options.undistort)
+    elif options.videos is not None:
+        main(options.videos, options.ext, skip_to=options.skip, cache_mb=options.cache,
+             use_index=not options.no_index, proxy_width=options.proxy, workers=options.workers,
+             dedup=options.dedup, img_format=options.format, quality=options.quality,
+             window_width=options.window, marks_path=options.marks, mark_step=options.mark_step,
+             catalog_path=options.catalog, calibration=options.undistort)
     else:
         main(data_path, file_extension, skip_to=skip_to)
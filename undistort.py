@@ -0,0 +1,141 @@
+from functions import Undistorter, encode_params
+
+import os
+import shutil
+import argparse
+import glob
+import cv2
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+Undistort a folder of images (and their YOLO labels) by calibration.npz of chessboard_undistort.py
+
+Images are cropped to the valid area, boxes and polygons of the labels are moved accordingly.
+Remap tables are built once per resolution, images are processed in a process pool.
+
+Usage:
+python undistort.py --images "/path/to/dataset" --calibration "./chessboard_exmpl/dataset/calibration.npz"
+python undistort.py --images "/path/to/images" --labels "/path/to/labels" --output "/path/to/undistorted"
+"""
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Undistort images and YOLO labels")
+    parser.add_argument(
+        "-i",
+        "--images",
+        type=str,
+        required=True,
+        help="Folder with images",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--calibration",
+        type=str,
+        required=True,
+        help="calibration.npz from chessboard_undistort.py",
+    )
+
+    parser.add_argument(
+        "-l",
+        "--labels",
+        type=str,
+        default="",
+        help="Folder with YOLO labels, default - labels next to the images if there are any",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="",
+        help="Output folder, default - <images>_undistorted. Labels are saved to <output>/labels",
+    )
+
+    parser.add_argument(
+        "--no-crop",
+        action="store_true",
+        help="Keep the whole frame with black borders instead of cropping to the valid area",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes (default - all cores)",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+# Таблицы remap строятся один раз в каждом процессе
+_undistorter = None
+
+
+def _init_worker(calibration, crop):
+    global _undistorter
+    _undistorter = Undistorter(calibration, crop)
+
+
+def undistort_image(image, label, output, output_labels):
+    """
+    returns (number of objects in the new label file or None if there is no label, error or None),
+    errors don't stop the pool
+    """
+    try:
+        return _undistort_image(image, label, output, output_labels), None
+    except Exception as e:
+        return None, "{}: {}".format(os.path.basename(image), e)
+
+
+def _undistort_image(image, label, output, output_labels):
+    img = cv2.imread(image)
+    if img is None:
+        raise ValueError("can`t read the image")
+    h, w = img.shape[:2]
+    cv2.imwrite(os.path.join(output, os.path.basename(image)), _undistorter(img),
+                encode_params(os.path.splitext(image)[1]))
+
+    if not os.path.isfile(label):
+        return None
+    with open(label) as f:
+        lines = _undistorter.labels(f.readlines(), w, h)
+    with open(os.path.join(output_labels, os.path.basename(label)), "w") as f:
+        f.writelines(line + "\n" for line in lines)
+    return len(lines)
+
+
+def main(opt):
+    images = sorted(f for f in glob.glob(os.path.join(opt.images, "*"))
+                    if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp", ".bmp")))
+    labels_path = opt.labels or opt.images
+    output = opt.output or opt.images.rstrip("/\\") + "_undistorted"
+    output_labels = os.path.join(output, "labels") if opt.labels else output
+    os.makedirs(output_labels, exist_ok=True)
+    if os.path.isfile(os.path.join(labels_path, "classes.txt")):
+        shutil.copy(os.path.join(labels_path, "classes.txt"), output_labels)
+
+    labels = [os.path.join(labels_path, os.path.splitext(os.path.basename(image))[0] + ".txt") for image in images]
+    n_labels = n_objects = n_errors = 0
+    with ProcessPoolExecutor(max_workers=opt.workers, initializer=_init_worker,
+                             initargs=(opt.calibration, not opt.no_crop)) as pool:
+        jobs = pool.map(undistort_image, images, labels, [output] * len(images), [output_labels] * len(images),
+                        chunksize=16)
+        for n, (objects, error) in enumerate(jobs):
+            if error is not None:
+                n_errors += 1
+                print("\rfailed:", error)
+            elif objects is not None:
+                n_labels += 1
+                n_objects += objects
+            if (n + 1) % 100 == 0:
+                print("\r{}/{}".format(n + 1, len(images)), end="")
+    print("\rimages: {}, labels: {}, objects: {}, errors: {}, saved to {}".format(
+        len(images), n_labels, n_objects, n_errors, output))
+
+
+if __name__ == "__main__":
+    main(get_args())
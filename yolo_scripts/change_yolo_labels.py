@@ -1,61 +1,58 @@
-import os
-import glob
+from remap_labels import confirm, read_classes, remap
 
-def change_labels(labels_dir, new_labels_dir, classes):
+import argparse
 
-    os.makedirs(new_labels_dir, exist_ok=True)
 
-    txts = glob.glob(os.path.join(labels_dir, "*.txt"))
+def get_args():
+    parser = argparse.ArgumentParser("Replace classes of yolo labels")
+    parser.add_argument(
+        "-l",
+        "--labels",
+        type=str,
+        default=None,
+        help="Folder with yolo labels",
+    )
 
-    if os.path.isfile(os.path.join(labels_dir, "classes.txt")):
-        with open(os.path.join(labels_dir, "classes.txt"), 'r') as f:
-            txt_labels = f.readlines()
-        print("\033[93mChange following classes:\033[0m")
-        for i in classes:
-            print(f"{i}->{classes[i]} : {txt_labels[int(i)]} --> {txt_labels[int(classes[i])]}".replace("\n", ""))
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Folder for new labels",
+    )
 
-        if input("\033[93mContinue? (y/n)\033[0m\n") == "y":
-            pass
-        else:
-            exit(1)
-    else:
-        if input("\033[93m[WARNING]: No classes.txt file. Continue? (y/n)\033[0m\n") == "y":
-
-            print("Change following classes:")
-            for i in classes:
-                print(f"{i}->{classes[i]}")
-        else:
-            exit(1)
-
-    print("START NEW DATASET CREATION..")
+    parser.add_argument(
+        "-c",
+        "--classes",
+        type=str,
+        nargs="+",
+        default=[],
+        help="old:new pairs. Example: 1:2",
+    )
 
-    for n, t in enumerate(txts):
-        print(f"\r{n + 1}/{len(txts)} {t}", end="")
+    parser.add_argument(
+        "-y",
+        "--yes",
+        action="store_true",
+        help="Don't ask for confirmation",
+    )
 
-        if "classes" in t or "test.txt" in t or "train.txt" in t or "scenes" in t:
-            continue
+    args = parser.parse_args()
+    return args
 
-        with open(t) as f:
-            labels = f.readlines()
 
-        labels_new = ""
-        for l in labels:
-            l = l.split()
-            if l[0] in classes:
-                l[0] = classes[l[0]]
-                labels_new += f"{l[0]} {l[1]} {l[2]} {l[3]} {l[4]}\n"
-            else:
-                labels_new += f"{l[0]} {l[1]} {l[2]} {l[3]} {l[4]}\n"
+def change_labels(labels_dir, new_labels_dir, classes, yes=False, workers=None):
 
-        new_txt_file = t.replace(labels_dir, new_labels_dir)
+    # {"1": "2"} -> {1: 2}
+    mapping = {int(old): int(new) for old, new in classes.items()}
 
-        txt_save_dir = "/".join(new_txt_file.split("/")[:-1])
+    if not confirm(mapping, read_classes(labels_dir), yes):
+        exit(1)
 
-        if not os.path.isdir(txt_save_dir):
-            os.makedirs(txt_save_dir)
+    print("START NEW DATASET CREATION..")
 
-        with open(new_txt_file, "w") as f:
-            f.write(labels_new)
+    files, written, dropped = remap(labels_dir, new_labels_dir, mapping, workers=workers)
+    print(f"{files} files, {written} objects saved to {new_labels_dir}")
 
 if __name__ == "__main__":
     labels_dir = "/home/mikhail/Рабочий стол/del/DATA/labels_truckbody_grub"
@@ -65,4 +62,8 @@ if __name__ == "__main__":
         "1": "2", # replace class 1 with class 2
     }
 
-    change_labels(labels_dir, new_labels_dir, classes_to_replace)
\ No newline at end of file
+    options = get_args()
+    if options.labels is not None:
+        change_labels(options.labels, options.output, dict(pair.split(":") for pair in options.classes), options.yes)
+    else:
+        change_labels(labels_dir, new_labels_dir, classes_to_replace)
@@ -0,0 +1,402 @@
+"""
+Columnar index of a YOLO labels folder.
+
+All objects of all label files are kept in NumPy arrays:
+file_id, cls, box (cx, cy, w, h), score and for segmentation labels polygon offsets into points (x, y).
+Lines are "cls cx cy w h" or "cls x1 y1 ... xk yk" (k >= 3), both with an optional trailing score
+(odd number of values - no score, even - score). Other lines are skipped and counted in bad.
+The index is cached in <labels>/.label_index as .npy files (opened memory-mapped),
+next runs re-parse only new and changed files (by size and mtime).
+If the labels folder is read-only, the cache goes to ~/.cache/label_index/<hash of the folder path>;
+if the cache can't be written at all, the index is kept in memory.
+Pool workers get the index object itself: a cached index is pickled as its paths and re-opened
+memory-mapped, an in-memory one is pickled with its arrays.
+
+Usage:
+index = LabelIndex("/path/to/labels")
+for name, cls, box in zip(index.names[index.file_id], index.cls, index.box):
+    ...
+lines = index.lines(file_id)
+
+python label_index.py "/path/to/labels" [--cache "/path/to/cache"]
+"""
+
+import io
+import os
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Не файлы разметки
+SKIP_FILES = ("classes.txt", "train.txt", "test.txt", "val.txt")
+CACHE_DIR = ".label_index"
+# Кэш для папок разметки только на чтение
+USER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "label_index")
+COLUMNS = ("names", "stats", "bad", "file_start", "file_id", "cls", "box", "score", "poly_start", "poly_len",
+           "points")
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Build or update the labels index")
+    parser.add_argument(
+        "labels",
+        type=str,
+        help="Folder with yolo labels",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes for parsing (default - all cores)",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--cache",
+        type=str,
+        default=None,
+        help="Cache folder (default - <labels>/.label_index, or ~/.cache/label_index/... for read-only labels)",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def default_cache_dir(labels_dir):
+    """<labels>/.label_index if it exists or can be created, else a per-folder dir in ~/.cache/label_index"""
+    cache_dir = os.path.join(labels_dir, CACHE_DIR)
+    if (os.path.isdir(cache_dir) and os.access(cache_dir, os.W_OK)) or os.access(labels_dir, os.W_OK):
+        return cache_dir
+    key = hashlib.sha1(os.path.abspath(labels_dir).encode()).hexdigest()[:16]
+    return os.path.join(USER_CACHE_DIR, key)
+
+
+def ranges(starts, lengths):
+    """concatenation of arange(start, start + length) for all pairs"""
+    starts = np.asarray(starts, np.int64)
+    lengths = np.asarray(lengths, np.int64)
+    return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+
+
+def parse_boxes(texts):
+    """
+    box-only label texts in one np.loadtxt call
+    returns (objects per file, cls, box, score) or None if lines are not all "cls cx cy w h" or all with score
+    """
+    if not any(text.strip() for text in texts):
+        return None
+    try:
+        values = np.loadtxt(io.StringIO("\n".join(texts)), np.float64, comments=None, ndmin=2)
+    except ValueError:
+        return None
+    if values.shape[1] not in (5, 6) or np.any(values[:, 0] != np.round(values[:, 0])):
+        return None
+    counts = np.array([len(text.split()) // values.shape[1] for text in texts], np.int64)
+    score = values[:, 5].astype(np.float32) if values.shape[1] == 6 else np.full(len(values), np.nan, np.float32)
+    return counts, values[:, 0].astype(np.int32), values[:, 1:5].astype(np.float32), score
+
+
+def parse_lines(text):
+    """
+    label text line by line, malformed lines are skipped
+    returns (cls, box, score, poly_len, points, bad lines)
+    """
+    cls, box, score, poly_len, points = [], [], [], [], []
+    bad = 0
+    for line in text.splitlines():
+        values = line.split()
+        if not values:
+            continue
+        # Бокс - 5 значений, полигон - класс и не меньше 3 пар координат (7), чётное число значений - score в конце
+        if len(values) < 5:
+            bad += 1
+            continue
+        try:
+            coords = [float(v) for v in values[1:]]
+            c = int(values[0])
+        except ValueError:
+            bad += 1
+            continue
+        cls.append(c)
+        score.append(coords.pop() if len(values) % 2 == 0 else np.nan)
+        if len(coords) > 4:
+            # Полигон сегментации, бокс - описывающий прямоугольник
+            poly = np.array(coords, np.float32).reshape(-1, 2)
+            x1, y1 = poly.min(axis=0)
+            x2, y2 = poly.max(axis=0)
+            box.append(((x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1))
+            poly_len.append(len(poly))
+            points.append(poly)
+        else:
+            box.append(coords)
+            poly_len.append(0)
+    return cls, box, score, poly_len, points, bad
+
+
+def parse_files(paths):
+    """
+    parse label files into columns
+    files with boxes only are parsed in bulk with one np.loadtxt per chunk (with and without score),
+    the rest line by line
+    returns (objects per file, bad lines per file, cls, box, score, poly_len, points)
+    """
+    texts = []
+    for path in paths:
+        with open(path) as f:
+            texts.append(f.read())
+
+    # Кандидаты на bulk: 5 или 6 значений на строку в среднем, точную проверку делает loadtxt
+    bulk = {}
+    for columns in (5, 6):
+        files = [i for i, text in enumerate(texts)
+                 if i not in bulk and len(text.split()) == columns * (text.strip().count("\n") + 1)]
+        boxes = parse_boxes([texts[i] for i in files]) if files else None
+        if boxes is None:
+            continue
+        if len(files) == len(texts):
+            counts, cls, box, score = boxes
+            return (counts, np.zeros(len(texts), np.int32), cls, box, score, np.zeros(len(cls), np.int32),
+                    np.zeros((0, 2), np.float32))
+        start = np.concatenate([[0], np.cumsum(boxes[0])]).tolist()
+        for n, i in enumerate(files):
+            bulk[i] = (boxes, slice(start[n], start[n + 1]))
+
+    counts, bad, cls, box, score, poly_len, points = [], [], [], [], [], [], []
+    for i, text in enumerate(texts):
+        if i in bulk:
+            boxes, rows = bulk[i]
+            counts.append(rows.stop - rows.start)
+            bad.append(0)
+            cls.append(boxes[1][rows])
+            box.append(boxes[2][rows])
+            score.append(boxes[3][rows])
+            poly_len.append(np.zeros(rows.stop - rows.start, np.int32))
+            continue
+        file_cls, file_box, file_score, file_poly_len, file_points, file_bad = parse_lines(text)
+        counts.append(len(file_cls))
+        bad.append(file_bad)
+        cls.append(np.array(file_cls, np.int32))
+        box.append(np.array(file_box, np.float32).reshape(-1, 4))
+        score.append(np.array(file_score, np.float32))
+        poly_len.append(np.array(file_poly_len, np.int32))
+        points.extend(file_points)
+    return (np.array(counts, np.int64), np.array(bad, np.int32),
+            np.concatenate(cls) if cls else np.zeros(0, np.int32),
+            np.concatenate(box) if box else np.zeros((0, 4), np.float32),
+            np.concatenate(score) if score else np.zeros(0, np.float32),
+            np.concatenate(poly_len) if poly_len else np.zeros(0, np.int32),
+            np.concatenate(points) if points else np.zeros((0, 2), np.float32))
+
+
+class LabelIndex:
+    """
+    names      (F,)   label file names
+    stats      (F, 2) size, mtime_ns
+    bad        (F,)   skipped malformed lines
+    file_start (F+1,) objects of file i are file_start[i]:file_start[i + 1]
+    file_id    (N,)   file of the object
+    cls        (N,)   class
+    box        (N, 4) cx, cy, w, h (polygon bounding box for segmentation labels)
+    score      (N,)   trailing score of the line, nan if there is none
+    poly_start (N,)   polygon of the object is points[poly_start:poly_start + poly_len]
+    poly_len   (N,)   0 for boxes
+    points     (M, 2) polygons points
+    """
+
+    def __init__(self, labels_dir, workers=None, update=True, cache_dir=None):
+        self.labels_dir = labels_dir
+        self.cache_dir = cache_dir or default_cache_dir(labels_dir)
+        self.cached = False
+        self.parsed = 0
+        if not self.load() or update:
+            self.update(workers)
+
+    def __getstate__(self):
+        # Сохранённый индекс передаётся в процессы пула только путями, остальной - целиком
+        if self.cached:
+            return {"labels_dir": self.labels_dir, "cache_dir": self.cache_dir, "cached": True, "parsed": self.parsed}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if state["cached"]:
+            self.load()
+
+    def __len__(self):
+        return len(self.cls)
+
+    @property
+    def bad_lines(self):
+        """number of skipped malformed lines in all files"""
+        return int(np.sum(self.bad))
+
+    @property
+    def files(self):
+        """label file paths"""
+        return [os.path.join(self.labels_dir, name) for name in self.names]
+
+    def load(self):
+        """open the cached index memory-mapped, returns False if there is no cache"""
+        self.cached = False
+        if not all(os.path.isfile(os.path.join(self.cache_dir, column + ".npy")) for column in COLUMNS):
+            self._set(*self._empty())
+            return False
+        self._set(*(np.load(os.path.join(self.cache_dir, column + ".npy"), mmap_mode="r") for column in COLUMNS))
+        self.cached = True
+        return True
+
+    def scan(self):
+        """{name: (size, mtime_ns)} of label files in the folder"""
+        stats = {}
+        with os.scandir(self.labels_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".txt") and entry.name not in SKIP_FILES and entry.is_file():
+                    st = entry.stat()
+                    stats[entry.name] = (st.st_size, st.st_mtime_ns)
+        return stats
+
+    def update(self, workers=None):
+        """re-parse new and changed files, drop deleted ones and save the cache. returns number of parsed files"""
+        stats = self.scan()
+        # tolist() вместо поэлементного доступа к memmap
+        cached = {name: (i, tuple(st)) for i, (name, st) in
+                  enumerate(zip(np.asarray(self.names).tolist(), np.asarray(self.stats).tolist()))}
+        keep = [cached[name][0] for name in sorted(stats) if name in cached and cached[name][1] == stats[name]]
+        changed = sorted(name for name in stats if name not in cached or cached[name][1] != stats[name])
+        if not changed and len(keep) == len(self.names):
+            return 0
+
+        parts = [self._select(keep)]
+        if changed:
+            paths = [os.path.join(self.labels_dir, name) for name in changed]
+            chunks = [paths[i:i + 1000] for i in range(0, len(paths), 1000)]
+            if len(chunks) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    results = list(pool.map(parse_files, chunks))
+            else:
+                results = [parse_files(chunk) for chunk in chunks]
+            for chunk, (counts, bad, cls, box, score, poly_len, points) in zip(chunks, results):
+                names = [os.path.basename(path) for path in chunk]
+                parts.append((np.array(names, dtype=str), np.array([stats[n] for n in names], np.int64).reshape(-1, 2),
+                              bad, counts, cls, box, score, poly_len, points))
+                if bad.any():
+                    print("- {} malformed lines skipped in {} files, e.g. {}".format(
+                        int(bad.sum()), int(np.count_nonzero(bad)), names[int(np.argmax(bad > 0))]))
+
+        self._set(*self._merge(parts))
+        self.cached = False
+        self.save()
+        self.parsed = len(changed)
+        return len(changed)
+
+    def save(self):
+        """write columns to a temporary folder and replace the cache, returns False if it can't be written"""
+        tmp = self.cache_dir + ".tmp"
+        try:
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            for column in COLUMNS:
+                np.save(os.path.join(tmp, column + ".npy"), getattr(self, column))
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.replace(tmp, self.cache_dir)
+        except OSError as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            # Индекс остаётся в памяти, следующий запуск разберёт файлы заново
+            print("\033[93m[WARNING]: label index is not cached: {}\033[0m".format(e))
+            self.cached = False
+            return False
+        return self.load()
+
+    def objects(self, file_id):
+        """slice of objects of the file"""
+        return slice(int(self.file_start[file_id]), int(self.file_start[file_id + 1]))
+
+    def polygon(self, i):
+        """points (K, 2) of the object or None for a box"""
+        if not self.poly_len[i]:
+            return None
+        return self.points[self.poly_start[i]:self.poly_start[i] + self.poly_len[i]]
+
+    def lines(self, file_id, cls=None):
+        """label lines of the file, cls - optional replacement classes of all objects"""
+        rows = self.objects(file_id)
+        cls = self.cls[rows] if cls is None else cls[rows]
+        lines = []
+        for i, c in zip(range(rows.start, rows.stop), cls):
+            poly = self.polygon(i)
+            values = list(self.box[i] if poly is None else poly.reshape(-1))
+            if not np.isnan(self.score[i]):
+                values.append(self.score[i])
+            lines.append(" ".join([str(c)] + ["{:.6f}".format(v) for v in values]))
+        return lines
+
+    def _set(self, names, stats, bad, file_start, file_id, cls, box, score, poly_start, poly_len, points):
+        self.names = names
+        self.stats = stats
+        self.bad = bad
+        self.file_start = file_start
+        self.file_id = file_id
+        self.cls = cls
+        self.box = box
+        self.score = score
+        self.poly_start = poly_start
+        self.poly_len = poly_len
+        self.points = points
+
+    @staticmethod
+    def _empty():
+        return (np.zeros(0, dtype=str), np.zeros((0, 2), np.int64), np.zeros(0, np.int32), np.zeros(1, np.int64),
+                np.zeros(0, np.int32), np.zeros(0, np.int32), np.zeros((0, 4), np.float32), np.zeros(0, np.float32),
+                np.zeros(0, np.int64), np.zeros(0, np.int32), np.zeros((0, 2), np.float32))
+
+    def _select(self, keep):
+        """(names, stats, bad, objects per file, cls, box, score, poly_len, points) of the cached files"""
+        keep = np.array(keep, np.int64)
+        counts = np.diff(self.file_start)[keep]
+        rows = ranges(np.asarray(self.file_start)[keep], counts)
+        poly_rows = ranges(np.asarray(self.poly_start)[rows], np.asarray(self.poly_len)[rows])
+        return (np.asarray(self.names)[keep], np.asarray(self.stats)[keep].reshape(-1, 2), np.asarray(self.bad)[keep],
+                counts,
+                np.asarray(self.cls)[rows], np.asarray(self.box)[rows].reshape(-1, 4), np.asarray(self.score)[rows],
+                np.asarray(self.poly_len)[rows], np.asarray(self.points)[poly_rows].reshape(-1, 2))
+
+    @staticmethod
+    def _merge(parts):
+        """concatenate parts and sort files by name"""
+        names = np.concatenate([p[0] for p in parts]).astype(str)
+        stats = np.concatenate([p[1] for p in parts])
+        bad = np.concatenate([p[2] for p in parts]).astype(np.int32)
+        counts = np.concatenate([p[3] for p in parts])
+        cls = np.concatenate([p[4] for p in parts])
+        box = np.concatenate([p[5] for p in parts])
+        score = np.concatenate([p[6] for p in parts])
+        poly_len = np.concatenate([p[7] for p in parts])
+        points = np.concatenate([p[8] for p in parts])
+
+        old_start = np.concatenate([[0], np.cumsum(counts)])
+        old_poly_start = np.concatenate([[0], np.cumsum(poly_len)])[:-1]
+        order = np.argsort(names, kind="stable")
+        rows = ranges(old_start[order], counts[order])
+        poly_rows = ranges(old_poly_start[rows], poly_len[rows])
+
+        counts = counts[order]
+        poly_len = poly_len[rows]
+        return (names[order], stats[order], bad[order], np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+                np.repeat(np.arange(len(order), dtype=np.int32), counts), cls[rows], box[rows], score[rows],
+                np.concatenate([[0], np.cumsum(poly_len)])[:-1].astype(np.int64), poly_len, points[poly_rows])
+
+
+def main(opt):
+    index = LabelIndex(opt.labels, opt.workers, cache_dir=opt.cache)
+    print("files: {}, objects: {}, polygons: {}, malformed lines: {}, parsed: {}".format(
+        len(index.names), len(index), int(np.count_nonzero(index.poly_len)), index.bad_lines, index.parsed))
+    print("cache:", index.cache_dir if index.cached else "not written")
+
+
+if __name__ == "__main__":
+    main(get_args())
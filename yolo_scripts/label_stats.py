@@ -0,0 +1,159 @@
+"""
+Statistics of a YOLO dataset from the label index (see label_index.py)
+
+- objects and files per class
+- objects-per-image histogram
+- box size (sqrt of relative area) and aspect ratio (w / h) distributions, all and per class
+- empty label files, skipped malformed lines, labels without images and images without labels
+
+Only changed label files are parsed again, so re-running on a dataset that barely changed is fast.
+
+Usage:
+python label_stats.py --labels "/path/to/labels" --images "/path/to/images" --output "/path/to/stats"
+creates stats.json and stats.csv (one row per class)
+"""
+
+from label_index import LabelIndex
+from remap_labels import read_classes
+
+import os
+import csv
+import json
+import argparse
+
+import numpy as np
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+SIZE_BINS = np.linspace(0, 1, 21)
+# w / h от 1/8 до 8, логарифмическая шкала
+ASPECT_BINS = 2.0 ** np.linspace(-3, 3, 13)
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Yolo labels statistics")
+    parser.add_argument(
+        "-l",
+        "--labels",
+        type=str,
+        required=True,
+        help="Folder with yolo labels",
+    )
+
+    parser.add_argument(
+        "-i",
+        "--images",
+        type=str,
+        default="",
+        help="Folder with images, to count missing images and unlabeled images",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default="",
+        help="Output path without extension, <output>.json and <output>.csv are created",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes for parsing changed labels (default - all cores)",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def distribution(values, bins):
+    """histogram and percentiles"""
+    counts, edges = np.histogram(np.clip(values, bins[0], bins[-1]), bins=bins)
+    return {"bins": [round(float(v), 4) for v in edges],
+            "counts": counts.tolist(),
+            "percentiles": {str(p): round(float(v), 4) for p, v in
+                            zip(PERCENTILES, np.percentile(values, PERCENTILES) if len(values) else [0] * 5)}}
+
+
+def label_stats(labels_dir, images_dir="", workers=None):
+    """statistics dict of the dataset"""
+    index = LabelIndex(labels_dir, workers)
+    classes = read_classes(labels_dir) or []
+    cls = np.asarray(index.cls)
+    box = np.asarray(index.box)
+    per_file = np.diff(np.asarray(index.file_start))
+
+    size = np.sqrt(np.clip(box[:, 2] * box[:, 3], 0, None))
+    aspect = box[:, 2] / np.maximum(box[:, 3], 1e-6)
+
+    n_classes = max(len(classes), int(cls.max()) + 1 if len(cls) else 0)
+    counts = np.bincount(cls, minlength=n_classes)
+    # Число файлов с классом: уникальные пары (файл, класс)
+    files_with = np.bincount(np.unique(np.asarray(index.file_id).astype(np.int64) * n_classes + cls) % n_classes,
+                             minlength=n_classes) if len(cls) else np.zeros(n_classes, np.int64)
+
+    stats = {
+        "files": len(index.names),
+        "objects": len(index),
+        "empty_labels": int(np.count_nonzero(per_file == 0)),
+        "bad_lines": index.bad_lines,
+        "polygons": int(np.count_nonzero(np.asarray(index.poly_len))),
+        "objects_per_image": {str(n): int(c) for n, c in enumerate(np.bincount(per_file)) if c},
+        "size": distribution(size, SIZE_BINS),
+        "aspect": distribution(aspect, ASPECT_BINS),
+        "classes": [],
+    }
+
+    for c in range(n_classes):
+        mask = cls == c
+        stats["classes"].append({
+            "class": c,
+            "name": classes[c] if c < len(classes) else "",
+            "objects": int(counts[c]),
+            "files": int(files_with[c]),
+            "size": distribution(size[mask], SIZE_BINS),
+            "aspect": distribution(aspect[mask], ASPECT_BINS),
+        })
+
+    if images_dir:
+        labeled = {os.path.splitext(name)[0] for name in np.asarray(index.names).tolist()}
+        with os.scandir(images_dir) as entries:
+            images = {os.path.splitext(e.name)[0] for e in entries if e.name.lower().endswith(IMAGE_EXTS)}
+        stats["missing_images"] = len(labeled - images)
+        stats["unlabeled_images"] = len(images - labeled)
+    return stats
+
+
+def save_stats(stats, output):
+    with open(output + ".json", "w") as f:
+        json.dump(stats, f, indent=1)
+
+    with open(output + ".csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["class", "name", "objects", "files"]
+                        + ["size_p{}".format(p) for p in PERCENTILES] + ["aspect_p{}".format(p) for p in PERCENTILES])
+        for row in stats["classes"]:
+            writer.writerow([row["class"], row["name"], row["objects"], row["files"]]
+                            + list(row["size"]["percentiles"].values()) + list(row["aspect"]["percentiles"].values()))
+
+
+def main(opt):
+    stats = label_stats(opt.labels, opt.images, opt.workers)
+
+    print("files: {files}, objects: {objects}, empty labels: {empty_labels}, malformed lines: {bad_lines}".format(**stats))
+    if "missing_images" in stats:
+        print("labels without images: {missing_images}, images without labels: {unlabeled_images}".format(**stats))
+    print("objects per image:", stats["objects_per_image"])
+    for row in stats["classes"]:
+        print("{class:>3} {name:<20} objects {objects:>8}  files {files:>8}  median size {size}  median aspect {aspect}"
+              .format(**dict(row, size=row["size"]["percentiles"]["50"], aspect=row["aspect"]["percentiles"]["50"])))
+
+    if opt.output:
+        save_stats(stats, opt.output)
+        print("saved to {0}.json, {0}.csv".format(opt.output))
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -0,0 +1,182 @@
+"""
+Class remap/select engine for YOLO labels
+
+mapping {old class: new class or None}: rename (1 -> 2), merge (1 -> 0, 2 -> 0), drop (3 -> None).
+Classes missing from the mapping are kept as is, or dropped with select=True.
+New classes of all objects are computed with one lookup table over the label index (see label_index.py),
+label files are written by a process pool.
+
+Usage:
+python remap_labels.py --labels "/path/to/labels" --output "/path/to/new_labels" --map 1:2 3:drop --yes
+python remap_labels.py --labels "/path/to/labels" --output "/path/to/new_labels" --map 0:0 2:1 3:2 --select
+"""
+
+from label_index import LabelIndex
+
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Файлов на одну задачу пула
+CHUNK = 20000
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Rename, merge, drop or select classes of yolo labels")
+    parser.add_argument(
+        "-l",
+        "--labels",
+        type=str,
+        required=True,
+        help="Folder with yolo labels",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        required=True,
+        help="Folder for new labels",
+    )
+
+    parser.add_argument(
+        "-m",
+        "--map",
+        type=str,
+        nargs="+",
+        required=True,
+        help="old:new pairs, old:drop to remove the class. Example: 1:2 3:drop",
+    )
+
+    parser.add_argument(
+        "--select",
+        action="store_true",
+        help="Drop classes missing from --map",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes (default - all cores)",
+    )
+
+    parser.add_argument(
+        "-y",
+        "--yes",
+        action="store_true",
+        help="Don't ask for confirmation",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+def parse_mapping(pairs):
+    """["1:2", "3:drop"] -> {1: 2, 3: None}"""
+    mapping = {}
+    for pair in pairs:
+        old, new = pair.split(":")
+        mapping[int(old)] = None if new in ("drop", "-", "") else int(new)
+    return mapping
+
+
+def lookup_table(mapping, max_cls, select=False):
+    """lut[old class] = new class, -1 - drop"""
+    size = max([max_cls] + list(mapping)) + 1
+    lut = np.full(size, -1, np.int32) if select else np.arange(size, dtype=np.int32)
+    for old, new in mapping.items():
+        lut[old] = -1 if new is None else new
+    return lut
+
+
+def read_classes(labels_dir):
+    """class names from classes.txt or None"""
+    path = os.path.join(labels_dir, "classes.txt")
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+def confirm(mapping, classes=None, yes=False):
+    """print the mapping, ask to continue unless yes"""
+    def name(i):
+        return classes[i] if classes is not None and 0 <= i < len(classes) else ""
+
+    if classes is None:
+        print("\033[93m[WARNING]: No classes.txt file.\033[0m")
+    print("\033[93mChange following classes:\033[0m")
+    for old, new in mapping.items():
+        if new is None:
+            print(f"{old} : {name(old)} --> dropped")
+        else:
+            print(f"{old}->{new} : {name(old)} --> {name(new)}")
+
+    if yes:
+        return True
+    return input("\033[93mContinue? (y/n)\033[0m\n") == "y"
+
+
+def write_files(index, result_dir, lut, start, stop):
+    """write files start:stop of the index with classes replaced by lut. returns number of written objects"""
+    first, last = int(index.file_start[start]), int(index.file_start[stop])
+    cls = lut[index.cls[first:last]].tolist()
+    box = np.asarray(index.box[first:last]).tolist()
+    poly_len = np.asarray(index.poly_len[first:last]).tolist()
+    # score сохраняется, если он был в исходной строке
+    score = ["" if np.isnan(v) else " %.6f" % v for v in np.asarray(index.score[first:last]).tolist()]
+
+    lines = []
+    for i, c in enumerate(cls):
+        if c < 0:
+            lines.append("")
+        elif poly_len[i]:
+            points = index.polygon(first + i).reshape(-1).tolist()
+            lines.append(str(c) + "".join(" {:.6f}".format(v) for v in points) + score[i] + "\n")
+        else:
+            lines.append("%d %.6f %.6f %.6f %.6f%s\n" % (c, *box[i], score[i]))
+
+    file_start = (np.asarray(index.file_start[start:stop + 1]) - first).tolist()
+    for n, name in enumerate(np.asarray(index.names[start:stop]).tolist()):
+        with open(os.path.join(result_dir, name), "w") as f:
+            f.write("".join(lines[file_start[n]:file_start[n + 1]]))
+    return sum(c >= 0 for c in cls)
+
+
+def remap(labels_dir, result_dir, mapping, select=False, workers=None):
+    """
+    apply mapping to all labels of labels_dir and write them to result_dir
+    returns (files, written objects, dropped objects)
+    """
+    index = LabelIndex(labels_dir, workers)
+    lut = lookup_table(mapping, int(index.cls.max()) if len(index) else 0, select)
+    os.makedirs(result_dir, exist_ok=True)
+
+    files = len(index.names)
+    chunks = [(start, min(start + CHUNK, files)) for start in range(0, files, CHUNK)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [pool.submit(write_files, index, result_dir, lut, start, stop) for start, stop in chunks]
+        written = 0
+        for n, job in enumerate(jobs):
+            written += job.result()
+            print(f"\rfiles {chunks[n][1]}/{files}", end="")
+    print()
+    if index.bad_lines:
+        print("\033[93m[WARNING]: {} malformed lines are not written\033[0m".format(index.bad_lines))
+    return files, written, len(index) - written
+
+
+def main(opt):
+    mapping = parse_mapping(opt.map)
+    if not confirm(mapping, read_classes(opt.labels), opt.yes):
+        exit(1)
+    files, written, dropped = remap(opt.labels, opt.output, mapping, opt.select, opt.workers)
+    print("files: {}, objects: {}, dropped: {}".format(files, written, dropped))
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -7,8 +7,10 @@ Fill cfg dict with your labels according to your classes.txt file. Comment label
 Also, this script providing info about original labels.
 """
 
+from label_stats import label_stats
+from remap_labels import remap
+
 import os
-import glob
 
 
 def form_alias_labels(cfg, result_path):
@@ -27,52 +29,25 @@ def form_alias_labels(cfg, result_path):
     return new_cfg
 
 
-def select_lables(cfg, path_labels, result_path):
+def select_lables(cfg, path_labels, result_path, workers=None):
     print("Sorting ...")
 
     os.makedirs(result_path, exist_ok=True)
 
     aliases = form_alias_labels(cfg, result_path)
 
-    lbl = glob.glob(os.path.join(path_labels, "*.txt"))
-    for i in lbl:
-        res = []
-        filename = os.path.split(i)[1]
-
-        if filename == "classes.txt":
-            continue
-
-        with open(i, "r") as f:
-            lines = f.readlines()
-
-        for j in lines:
-            line = j.split(" ")
-            if line[0] in cfg:
-                line[0] = str(aliases[line[0]])
-                res.append(" ".join(line))
-        with open(os.path.join(result_path, filename), 'w') as fp:
-            for item in res:
-                fp.write(item)
+    # Классы не из cfg удаляются, остальные нумеруются заново
+    mapping = {int(old): new for old, new in aliases.items()}
+    files, written, dropped = remap(path_labels, result_path, mapping, select=True, workers=workers)
+    print(f"files: {files}, objects: {written}, dropped: {dropped}")
 
     print("Done !")
 
 
 def labels_stats(labels_path):
-    result = {}
-    lbl = glob.glob(os.path.join(labels_path, "*.txt"))
-    for i in lbl:
-        filename = os.path.split(i)[1]
-        if filename == "classes.txt":
-            continue
-
-        with open(i, "r") as f:
-            lines = f.readlines()
-        for j in lines:
-            lbl = j.split(" ")[0]
-            if lbl not in result:
-                result[lbl] = 1
-            else:
-                result[lbl] += 1
+    # Классы берутся из индекса, файлы перечитываются только если изменились
+    stats = label_stats(labels_path)
+    result = {str(row["class"]): row["objects"] for row in stats["classes"] if row["objects"]}
     print(result)
 
 
@@ -1,19 +1,39 @@
 """Yolo labels into jsons with backwards bbox transformation.
 
-P.S. in modify_box change your image xywh
+P.S. for per-label jsons set your image size with --size
 
+--coco: whole labels folder into one COCO json. Image sizes are read from the image headers,
+labels are parsed through the label index (label_index.py) and converted in a process pool,
+the json is written by parts.
+
+Usage:
+python yolo2coco.py --labels "/path/to/labels" --jsons_path "/path/to/jsons" --size 2048 2448
+python yolo2coco.py --labels "/path/to/labels" --images "/path/to/images" --coco "/path/to/coco.json"
 """
 
+from label_index import LabelIndex
+from remap_labels import read_classes
+
 import os
 import json
+import struct
+import shutil
 from glob import glob
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
 
-def modify_box(box): # TODO image size fix 
-    x = float(box[0]) * 2048
-    y = float(box[1]) * 2448
-    w = float(box[2]) * 2048
-    h = float(box[3]) * 2448
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+# Файлов на одну задачу пула
+CHUNK = 5000
+
+def modify_box(box, width=2048, height=2448):
+    x = float(box[0]) * width
+    y = float(box[1]) * height
+    w = float(box[2]) * width
+    h = float(box[3]) * height
     
     x = (x * 2 - w) / 2
     y = (y * 2 - h) / 2
@@ -23,9 +43,9 @@ def modify_box(box): # TODO image size fix
     return box_new
 
 
-def create_jsons(input_path, save_path):
+def create_jsons(input_path, save_path, image_size=(2048, 2448)):
     # Read all files
-    file_names = glob(input_path + '*.txt')
+    file_names = glob(os.path.join(input_path, '*.txt'))
     
     # Create save directory
     if not os.path.exists(save_path):
@@ -45,7 +65,7 @@ def create_jsons(input_path, save_path):
             camera = {}
             camera['class'] = int(line[0])
             
-            box = modify_box(line[1:5])
+            box = modify_box(line[1:5], *image_size)
             camera['box'] = box
             
             if len(line)!=6:
@@ -61,9 +81,165 @@ def create_jsons(input_path, save_path):
         json_object = json.dumps(d, indent=4)
         
         # Writing to sample.json
-        with open(f"{save_path + image_name}.json", "w") as outfile:
+        with open(os.path.join(save_path, image_name + ".json"), "w") as outfile:
             outfile.write(json_object)
 
+
+def image_size(path):
+    """(width, height) from the image header without decoding, None if the format is unknown"""
+    with open(path, "rb") as f:
+        head = f.read(32)
+        if head[:8] == b"\x89PNG\r\n\x1a\n":
+            return struct.unpack(">II", head[16:24])
+        if head[:2] == b"BM":
+            w, h = struct.unpack("<ii", head[18:26])
+            return w, abs(h)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            if head[12:16] == b"VP8 ":
+                w, h = struct.unpack("<HH", head[26:30])
+                return w & 0x3FFF, h & 0x3FFF
+            if head[12:16] == b"VP8L":
+                bits = int.from_bytes(head[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if head[12:16] == b"VP8X":
+                return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+        if head[:2] == b"\xff\xd8":
+            # Маркеры JPEG до SOFn, в нём высота и ширина
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                if marker[1] in (0xD8, 0x01) or 0xD0 <= marker[1] <= 0xD7:
+                    continue
+                length = struct.unpack(">H", f.read(2))[0]
+                if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                    h, w = struct.unpack(">xHH", f.read(5))
+                    return w, h
+                f.seek(length - 2, 1)
+    return None
+
+
+def find_images(images_dir):
+    """{name without extension: image file name}"""
+    with os.scandir(images_dir) as entries:
+        return {os.path.splitext(e.name)[0]: e.name for e in entries if e.name.lower().endswith(IMAGE_EXTS)}
+
+
+def coco_chunk(index, images_dir, images, start, stop):
+    """
+    COCO images and annotations of index files start:stop as json fragments
+    images - {name without extension: image file name} for the labels of this chunk only
+    image id = file id + 1, annotation id = object row + 1
+    returns (images json, annotations json, images, annotations, labels without a readable image)
+    """
+    names = np.asarray(index.names[start:stop]).tolist()
+    file_start = np.asarray(index.file_start[start:stop + 1])
+
+    sizes = np.zeros((stop - start, 2), np.float64)
+    coco_images = []
+    for n, name in enumerate(names):
+        image = images.get(os.path.splitext(name)[0])
+        if image is None:
+            continue
+        path = os.path.join(images_dir, image)
+        try:
+            size = image_size(path)
+        except (OSError, struct.error):
+            size = None
+        if size is None:
+            frame = cv2.imread(path)
+            if frame is None:
+                # Не читается ни заголовок, ни само изображение - считаем, что изображения нет
+                continue
+            h, w = frame.shape[:2]
+            size = w, h
+        sizes[n] = size
+        coco_images.append({"id": start + n + 1, "file_name": image, "width": int(size[0]), "height": int(size[1])})
+
+    # Размеры изображений для каждого объекта, перевод боксов в пиксели одной операцией
+    first, last = int(file_start[0]), int(file_start[-1])
+    wh = np.repeat(sizes, np.diff(file_start), axis=0)
+    box = np.asarray(index.box[first:last], np.float64)
+    xywh = np.empty_like(box)
+    xywh[:, :2] = (box[:, :2] - box[:, 2:] / 2) * wh
+    xywh[:, 2:] = box[:, 2:] * wh
+    area = xywh[:, 2] * xywh[:, 3]
+    file_id = np.asarray(index.file_id[first:last]) + 1
+    cls = np.asarray(index.cls[first:last])
+    poly_len = np.asarray(index.poly_len[first:last])
+    score = np.asarray(index.score[first:last])
+
+    annotations = []
+    for i in np.flatnonzero(wh[:, 0] > 0).tolist():
+        segmentation = []
+        obj_area = area[i]
+        if poly_len[i]:
+            points = index.polygon(first + i) * wh[i]
+            segmentation = [np.round(points.reshape(-1), 2).tolist()]
+            x, y = points[:, 0], points[:, 1]
+            obj_area = 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+        annotations.append({"id": first + i + 1, "image_id": int(file_id[i]), "category_id": int(cls[i]),
+                            "bbox": np.round(xywh[i], 2).tolist(), "area": round(float(obj_area), 2),
+                            "segmentation": segmentation, "iscrowd": 0})
+        if not np.isnan(score[i]):
+            annotations[-1]["score"] = round(float(score[i]), 4)
+    return (json.dumps(coco_images)[1:-1], json.dumps(annotations)[1:-1], len(coco_images), len(annotations),
+            len(names) - len(coco_images))
+
+
+def create_coco(labels_dir, images_dir, output, workers=None):
+    """
+    one COCO json for the whole labels folder, images and annotations arrays are written chunk by chunk
+    into <output>.tmp, which replaces output only when everything is written
+    returns (images, annotations, labels without a readable image)
+    """
+    index = LabelIndex(labels_dir, workers)
+    images = find_images(images_dir)
+    classes = read_classes(labels_dir)
+    if classes is None:
+        classes = [str(c) for c in range(int(np.max(index.cls)) + 1 if len(index) else 0)]
+    categories = [{"id": c, "name": name, "supercategory": ""} for c, name in enumerate(classes)]
+
+    files = len(index.names)
+    chunks = [(start, min(start + CHUNK, files)) for start in range(0, files, CHUNK)]
+    # Каждой задаче только изображения её файлов разметки, а не весь словарь
+    stems = [os.path.splitext(name)[0] for name in np.asarray(index.names).tolist()]
+    chunk_images = [{stem: images[stem] for stem in stems[start:stop] if stem in images} for start, stop in chunks]
+    n_images = n_annotations = missing = 0
+    tmp = output + ".tmp"
+    ann_tmp = output + ".annotations.tmp"
+    try:
+        with open(tmp, "w") as out, open(ann_tmp, "w") as ann, ProcessPoolExecutor(max_workers=workers) as pool:
+            out.write('{"info": {"description": "yolo2coco"}, "categories": %s, "images": [' % json.dumps(categories))
+            jobs = [pool.submit(coco_chunk, index, images_dir, chunk_images[n], start, stop)
+                    for n, (start, stop) in enumerate(chunks)]
+            for n, job in enumerate(jobs):
+                coco_images, annotations, chunk_n_images, chunk_n_annotations, no_image = job.result()
+                if chunk_n_images:
+                    out.write(("," if n_images else "") + coco_images)
+                    n_images += chunk_n_images
+                if chunk_n_annotations:
+                    ann.write(("," if n_annotations else "") + annotations)
+                    n_annotations += chunk_n_annotations
+                missing += no_image
+                print(f"\rfiles {chunks[n][1]}/{files}", end="")
+            print()
+
+            # Аннотации копируются из временного файла после массива изображений
+            out.write('], "annotations": [')
+            ann.flush()
+            with open(ann_tmp) as f:
+                shutil.copyfileobj(f, out)
+            out.write("]}")
+        os.replace(tmp, output)
+    finally:
+        # При ошибке не остаётся ни обрезанного json, ни временных файлов
+        for path in (tmp, ann_tmp):
+            if os.path.exists(path):
+                os.remove(path)
+    return n_images, n_annotations, missing
+
 def get_args():
     parser = argparse.ArgumentParser("Split Yolo data to train format")
     parser.add_argument(
@@ -81,20 +257,58 @@ def get_args():
         help="Output path for jsons ",
     )
 
+    parser.add_argument(
+        "-s",
+        "--size",
+        type=int,
+        nargs=2,
+        default=(2048, 2448),
+        help="Image width and height for per-label jsons",
+    )
+
+    parser.add_argument(
+        "-i",
+        "--images",
+        type=str,
+        default="",
+        help="Folder with images, to read their sizes for --coco",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--coco",
+        type=str,
+        default="",
+        help="Write one COCO json for the whole labels folder",
+    )
+
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes for --coco (default - all cores)",
+    )
+
     args = parser.parse_args()
     return args
 
 def main(opt):
-    labels_dir = opt.images
+    labels_dir = opt.labels
     jsons_dir = opt.jsons_path
 
-    create_jsons(labels_dir, jsons_dir)
+    if opt.coco:
+        n_images, n_annotations, missing = create_coco(labels_dir, opt.images or labels_dir, opt.coco, opt.workers)
+        print(f"images: {n_images}, annotations: {n_annotations}, labels without image: {missing}")
+        return
+
+    create_jsons(labels_dir, jsons_dir, opt.size)
 
 
 if __name__ == "__main__":
     options = get_args()
 
-    if options.images is not None:
+    if options.labels is not None:
         main(options)
     else:
         input_path = "project/labels"